@@ -0,0 +1,292 @@
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import stream_inflate
+
+
+# The input, suspend and output sizes exercised by the tests. By default only a few
+# combinations of these are run, since 1-byte input chunks are orders of magnitude slower
+SIZES = (1, 7, 65536)
+DEFAULT_SETTINGS = (
+    (65536, 65536, 65536),
+    (65536, 65536, 7),
+    (7, 7, 65536),
+    (1, 65536, 65536),
+    (65536, 1, 65536),
+)
+
+BLOCK_TYPES = {
+    'stored': (0, zlib.Z_DEFAULT_STRATEGY),
+    'fixed': (9, zlib.Z_FIXED),
+    'dynamic': (9, zlib.Z_DEFAULT_STRATEGY),
+}
+
+
+def compressible_data(size):
+    rnd = random.Random()
+    rnd.seed(1)
+    words = [b'alpha', b'beta', b'gamma', b'delta', b'epsilon', b'zeta', b'eta', b'theta']
+    data = bytearray()
+    while len(data) < size:
+        data += rnd.choice(words) + str(rnd.randint(0, 999)).encode() + b' '
+    return bytes(data[:size])
+
+
+def random_data(size):
+    rnd = random.Random()
+    rnd.seed(1)
+    return rnd.getrandbits(size * 8).to_bytes(size, byteorder='big')
+
+
+DATA = {
+    'compressible': compressible_data,
+    'random': random_data,
+}
+
+
+def content(stream, input_size):
+    for i in range(0, len(stream), input_size):
+        yield stream[i:i + input_size]
+
+
+def compressed_iters(stream, input_size, suspend_size):
+    return (
+        content(stream[i:i + suspend_size], input_size)
+        for i in range(0, len(stream), suspend_size)
+    )
+
+
+def run_stream_inflate(inflater, stream, input_size, suspend_size, chunk_size):
+    uncompressed_chunks, is_done, _ = inflater(chunk_size=chunk_size)
+    num_bytes = 0
+    num_calls = 0
+    for it in compressed_iters(stream, input_size, suspend_size):
+        for chunk in uncompressed_chunks(it):
+            num_bytes += len(chunk)
+        num_calls += 1
+        if is_done():
+            break
+    return num_bytes, num_calls
+
+
+def run_zlib(stream, input_size, suspend_size, chunk_size):
+    decompressobj = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+    num_bytes = 0
+    num_calls = 0
+    for it in compressed_iters(stream, input_size, suspend_size):
+        for compressed_chunk in it:
+            compressed_chunk = decompressobj.unconsumed_tail + compressed_chunk
+            while compressed_chunk:
+                num_bytes += len(decompressobj.decompress(compressed_chunk, chunk_size))
+                compressed_chunk = decompressobj.unconsumed_tail
+        num_calls += 1
+        if decompressobj.eof:
+            break
+    num_bytes += len(decompressobj.flush())
+    return num_bytes, num_calls
+
+
+def best_time(func, repeats):
+    best = None
+    for _ in range(0, repeats):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def cases(size, settings, deflate64_fixture):
+    for data_name, block_type in itertools.product(DATA, BLOCK_TYPES):
+        data = DATA[data_name](size)
+        level, strategy = BLOCK_TYPES[block_type]
+        compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS, strategy=strategy)
+        stream = compressobj.compress(data) + compressobj.flush()
+        for input_size, suspend_size, chunk_size in settings:
+            yield 'deflate', block_type, data_name, stream, len(data), input_size, suspend_size, chunk_size
+
+    # There's no Deflate64 compressor in the standard library, so the only Deflate64 data is the
+    # fixture used by the tests
+    if deflate64_fixture is not None:
+        with open(deflate64_fixture, 'rb') as f:
+            stream = f.read()
+        uncompressed_size = sum(len(chunk) for chunk in stream_inflate.stream_inflate64()[0]((stream,)))
+        for input_size, suspend_size, chunk_size in settings:
+            yield 'deflate64', 'fixture', 'fixture', stream, uncompressed_size, input_size, suspend_size, chunk_size
+
+
+def per_call_overhead(inflater, repeats):
+    # An empty final fixed Huffman block: what's measured is almost entirely the cost of setting
+    # up a decompressor and calling it
+    stream = b'\x03\x00'
+    num = 1000
+
+    def setup_and_call():
+        for _ in range(0, num):
+            uncompressed_chunks, _, _ = inflater()
+            for _ in uncompressed_chunks((stream,)):
+                pass
+
+    uncompressed_chunks, _, _ = inflater()
+
+    def call():
+        for _ in range(0, num):
+            for _ in uncompressed_chunks(()):
+                pass
+
+    return {
+        'setup_and_call_us': best_time(setup_and_call, repeats)[0] / num * 1e6,
+        'call_us': best_time(call, repeats)[0] / num * 1e6,
+    }
+
+
+def thread_scaling(size, repeats, thread_counts):
+    # The same total number of independent streams are uncompressed with each number of threads,
+    # so with a compiled build, which releases the GIL while decoding symbols, throughput should
+    # increase with the number of threads up to the number of cores
+    data = compressible_data(size)
+    compressobj = zlib.compressobj(level=9, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+    num_streams = 2 * max(thread_counts)
+    results = []
+
+    for num_threads in thread_counts:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            seconds, _ = best_time(lambda: list(executor.map(
+                lambda _: run_stream_inflate(stream_inflate.stream_inflate, stream, 65536, 65536, 65536),
+                range(0, num_streams),
+            )), repeats)
+        results.append({
+            'threads': num_threads,
+            'streams': num_streams,
+            'seconds': seconds,
+            'mb_per_s': num_streams * len(data) / seconds / 1e6,
+            'speedup': results[0]['seconds'] / seconds if results else 1.0,
+        })
+        print('{threads} threads: {mb_per_s:.2f} MB/s, {speedup:.2f}x'.format(**results[-1]), file=sys.stderr)
+
+    return results
+
+
+def run(size, settings, repeats, deflate64_fixture, thread_counts):
+    inflaters = {
+        'deflate': stream_inflate.stream_inflate,
+        'deflate64': stream_inflate.stream_inflate64,
+    }
+    results = []
+
+    for format_name, block_type, data_name, stream, uncompressed_size, input_size, suspend_size, chunk_size in cases(size, settings, deflate64_fixture):
+        inflater = inflaters[format_name]
+        seconds, (num_bytes, num_calls) = best_time(lambda: run_stream_inflate(inflater, stream, input_size, suspend_size, chunk_size), repeats)
+        assert num_bytes == uncompressed_size
+        result = {
+            'name': '{}-{}-{}-input_{}-suspend_{}-chunk_{}'.format(format_name, block_type, data_name, input_size, suspend_size, chunk_size),
+            'format': format_name,
+            'block_type': block_type,
+            'data': data_name,
+            'input_size': input_size,
+            'suspend_size': suspend_size,
+            'chunk_size': chunk_size,
+            'compressed_bytes': len(stream),
+            'uncompressed_bytes': uncompressed_size,
+            'num_calls': num_calls,
+            'seconds': seconds,
+            'mb_per_s': uncompressed_size / seconds / 1e6,
+            'us_per_call': seconds / num_calls * 1e6,
+            'peak_memory_bytes': peak_memory(lambda: run_stream_inflate(inflater, stream, input_size, suspend_size, chunk_size)),
+            'zlib_seconds': None,
+            'zlib_mb_per_s': None,
+        }
+        if format_name == 'deflate':
+            zlib_seconds, (num_bytes, _) = best_time(lambda: run_zlib(stream, input_size, suspend_size, chunk_size), repeats)
+            assert num_bytes == uncompressed_size
+            result['zlib_seconds'] = zlib_seconds
+            result['zlib_mb_per_s'] = uncompressed_size / zlib_seconds / 1e6
+        results.append(result)
+        print('{name}: {mb_per_s:.2f} MB/s, {peak_memory_bytes} bytes peak'.format(**result), file=sys.stderr)
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'compiled': stream_inflate._compiled,
+        'size': size,
+        'repeats': repeats,
+        'per_call_overhead': {
+            format_name: per_call_overhead(inflater, repeats)
+            for format_name, inflater in inflaters.items()
+        },
+        'results': results,
+        'thread_scaling': thread_scaling(size, repeats, thread_counts) if thread_counts else [],
+    }
+
+
+def compare(baseline, current, max_regression):
+    # Returns the names of results that are slower, or use more memory, by more than the allowed
+    # fraction compared to the baseline
+    baseline_results = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        baseline_result = baseline_results.get(result['name'])
+        if baseline_result is None:
+            continue
+        speed_ratio = result['mb_per_s'] / baseline_result['mb_per_s']
+        memory_ratio = result['peak_memory_bytes'] / max(baseline_result['peak_memory_bytes'], 1)
+        print('{}: {:.2f}x speed, {:.2f}x peak memory'.format(result['name'], speed_ratio, memory_ratio), file=sys.stderr)
+        if speed_ratio < 1 - max_regression or memory_ratio > 1 + max_regression:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark stream-inflate, with zlib as a baseline')
+    parser.add_argument('--size', type=int, default=1048576, help='number of bytes of uncompressed data for each Deflate case')
+    parser.add_argument('--repeats', type=int, default=3, help='number of times to run each case, taking the fastest')
+    parser.add_argument('--all-settings', action='store_true', help='run every combination of input, suspend and chunk sizes that the tests use')
+    parser.add_argument('--threads', default='1,2,4,8', help='comma-separated numbers of threads to uncompress independent streams with, or an empty string to skip')
+    parser.add_argument('--deflate64-fixture', default='fixtures/deflate64.bin', help='Deflate64 stream to benchmark, or an empty string to skip')
+    parser.add_argument('--output', help='file to write the JSON results to, rather than standard output')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='fraction slower or larger than the compared results that counts as a regression')
+    args = parser.parse_args(argv)
+
+    settings = tuple(itertools.product(SIZES, SIZES, SIZES)) if args.all_settings else DEFAULT_SETTINGS
+    thread_counts = tuple(int(num_threads) for num_threads in args.threads.split(',') if num_threads)
+    results = run(args.size, settings, args.repeats, args.deflate64_fixture or None, thread_counts)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.max_regression)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)), file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
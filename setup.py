@@ -31,5 +31,6 @@ setup(
     },
     py_modules=[
         'stream_inflate',
+        'stream_inflate_cli',
     ],
 )
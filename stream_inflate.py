@@ -1,487 +1,2088 @@
-from collections import Counter, defaultdict, namedtuple
-
-
-def stream_inflate(chunk_size=65536):
-    length_extra_bits_diffs = (
-        (0, 3), (0, 4), (0, 5), (0, 6), (0, 7), (0, 8), (0, 9), (0, 10),
-        (1, 11), (1, 13), (1, 15), (1, 17),
-        (2, 19), (2, 23), (2, 27), (2, 31),
-        (3, 35), (3, 43), (3, 51), (3, 59),
-        (4, 67), (4, 83), (4, 99), (4, 115),
-        (5, 131), (5, 163), (5, 195), (5, 227),
-        (0, 258),
+import contextlib
+import io
+import os
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import Counter, defaultdict, deque, namedtuple
+from functools import lru_cache
+from struct import Struct, error as struct_error
+from time import perf_counter
+
+try:
+    import cython
+except ImportError:
+    # So the module runs as plain Python without Cython installed: the types are only used in
+    # annotations, and the decorators only have an effect when compiled
+    class _CythonType:
+        def __getitem__(self, _):
+            return self
+
+    class cython:
+        compiled = False
+        const = uchar = uint = ulonglong = Py_ssize_t = int = bint = _CythonType()
+        nogil = contextlib.nullcontext()
+
+        @staticmethod
+        def boundscheck(_):
+            return lambda func: func
+
+        @staticmethod
+        def wraparound(_):
+            return lambda func: func
+
+        @staticmethod
+        def cast(_, value):
+            return value
+
+
+_deflate_length_extra_bits_diffs = (
+    (0, 3), (0, 4), (0, 5), (0, 6), (0, 7), (0, 8), (0, 9), (0, 10),
+    (1, 11), (1, 13), (1, 15), (1, 17),
+    (2, 19), (2, 23), (2, 27), (2, 31),
+    (3, 35), (3, 43), (3, 51), (3, 59),
+    (4, 67), (4, 83), (4, 99), (4, 115),
+    (5, 131), (5, 163), (5, 195), (5, 227),
+    (0, 258),
+)
+_deflate_dist_extra_bits_diffs = (
+    (0, 1), (0, 2), (0, 3), (0, 4),
+    (1, 5), (1, 7), (2, 9), (2, 13),
+    (3, 17), (3, 25), (4, 33), (4, 49),
+    (5, 65), (5, 97), (6, 129), (6, 193),
+    (7, 257), (7, 385), (8, 513), (8, 769),
+    (9, 1025), (9, 1537), (10, 2049), (10, 3073),
+    (11, 4097), (11, 6145), (12, 8193), (12, 12289),
+    (13, 16385), (13, 24577),
+)
+_deflate64_length_extra_bits_diffs = (
+    (0, 3), (0, 4), (0, 5), (0, 6), (0, 7), (0, 8), (0, 9), (0, 10),
+    (1, 11), (1, 13), (1, 15), (1, 17),
+    (2, 19), (2, 23), (2, 27), (2, 31),
+    (3, 35), (3, 43), (3, 51), (3, 59),
+    (4, 67), (4, 83), (4, 99), (4, 115),
+    (5, 131), (5, 163), (5, 195), (5, 227),
+    (16, 3),
+)
+_deflate64_dist_extra_bits_diffs = (
+    (0, 1), (0, 2), (0, 3), (0, 4),
+    (1, 5), (1, 7), (2, 9), (2, 13),
+    (3, 17), (3, 25), (4, 33), (4, 49),
+    (5, 65), (5, 97), (6, 129), (6, 193),
+    (7, 257), (7, 385), (8, 513), (8, 769),
+    (9, 1025), (9, 1537), (10, 2049), (10, 3073),
+    (11, 4097), (11, 6145), (12, 8193), (12, 12289),
+    (13, 16385), (13, 24577), (14, 32769), (14, 49153),
+)
+
+_deflate_params = {
+    False: (_deflate_length_extra_bits_diffs, _deflate_dist_extra_bits_diffs, 32768),
+    True: (_deflate64_length_extra_bits_diffs, _deflate64_dist_extra_bits_diffs, 65536),
+}
+
+
+def stream_inflate(chunk_size=65536, on_block=None, use_zlib=False, skip=0, max_output_size=None, max_ratio=None):
+    inflater = _stream_inflate(*_deflate_params[False], chunk_size, on_block=on_block, use_zlib=use_zlib, skip=skip, max_output_size=max_output_size, max_ratio=max_ratio)
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed
+
+
+def stream_inflate64(chunk_size=65536, on_block=None, skip=0, max_output_size=None, max_ratio=None):
+    inflater = _stream_inflate(*_deflate_params[True], chunk_size, on_block=on_block, skip=skip, max_output_size=max_output_size, max_ratio=max_ratio)
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed
+
+
+def stream_inflate_flushing(chunk_size=65536):
+    inflater = _stream_inflate(*_deflate_params[False], chunk_size, split_at_flush=True)
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed, inflater.is_at_flush
+
+
+def stream_inflate64_flushing(chunk_size=65536):
+    inflater = _stream_inflate(*_deflate_params[True], chunk_size, split_at_flush=True)
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed, inflater.is_at_flush
+
+
+def stream_inflate_size(compressed_chunks, use_zlib=False):
+    return _stream_inflate_size(False, compressed_chunks, use_zlib)
+
+
+def stream_inflate64_size(compressed_chunks):
+    return _stream_inflate_size(True, compressed_chunks, False)
+
+
+# Runs through the entire stream only updating the decoder's window, and never copying out of it
+def _stream_inflate_size(deflate64, compressed_chunks, use_zlib):
+    inflater = _stream_inflate(*_deflate_params[deflate64], 65536, use_zlib=use_zlib)
+    num_bytes_in = 0
+
+    def _compressed_chunks():
+        nonlocal num_bytes_in
+
+        for compressed_chunk in compressed_chunks:
+            num_bytes_in += len(compressed_chunk)
+            yield compressed_chunk
+
+    uncompressed_size = inflater.discard(_compressed_chunks(), None)
+    if not inflater.is_done():
+        raise TruncatedStream('Compressed input ended before the end of the stream')
+
+    return uncompressed_size, num_bytes_in - inflater.num_bytes_unconsumed(), inflater.num_bytes_unconsumed()
+
+
+def stream_inflate_reusable(chunk_size=65536, use_zlib=False):
+    inflater = _stream_inflate(*_deflate_params[False], chunk_size, use_zlib=use_zlib)
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed, inflater.reset
+
+
+def stream_inflate64_reusable(chunk_size=65536):
+    inflater = _stream_inflate(*_deflate_params[True], chunk_size)
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed, inflater.reset
+
+
+def stream_inflate_into(use_zlib=False):
+    inflater = _stream_inflate(*_deflate_params[False], 65536, use_zlib=use_zlib)
+    return inflater.uncompressed_into, inflater.is_done, inflater.num_bytes_unconsumed
+
+
+def stream_inflate64_into():
+    inflater = _stream_inflate(*_deflate_params[True], 65536)
+    return inflater.uncompressed_into, inflater.is_done, inflater.num_bytes_unconsumed
+
+
+def stream_inflate_file(compressed, use_zlib=False):
+    return _StreamInflateFile(stream_inflate_into(use_zlib), compressed)
+
+
+def stream_inflate64_file(compressed):
+    return _StreamInflateFile(stream_inflate64_into(), compressed)
+
+
+def stream_inflate_buffer(compressed, uncompressed_size=None, use_zlib=False):
+    return _stream_inflate_buffer(False, compressed, uncompressed_size, use_zlib)
+
+
+def stream_inflate64_buffer(compressed, uncompressed_size=None):
+    return _stream_inflate_buffer(True, compressed, uncompressed_size, False)
+
+
+# The entire compressed stream is a single chunk, and is uncompressed into the decoder's window and
+# copied from there into one output buffer. If the uncompressed size is known the buffer is
+# allocated up front, with one more byte than needed since the end of the stream can be after the
+# last uncompressed byte, so finding the end doesn't need a bigger buffer. Otherwise it starts at a
+# typical compression ratio, and is doubled as needed. Calls to the decoder are up to 1MiB rather
+# than 64KiB, so fewer times through its state machine, but no bigger than the initial buffer so
+# small streams don't need a large window. They're at least 64KiB whatever the buffer, since the
+# uncompressed size can be an underestimate
+def _stream_inflate_buffer(deflate64, compressed, uncompressed_size, use_zlib):
+    # The decoder is slightly faster with bytes than memoryviews, so bytes are used as they are
+    compressed = compressed if isinstance(compressed, bytes) else memoryview(compressed).cast('B')
+    uncompressed = bytearray(
+        uncompressed_size + 1 if uncompressed_size is not None else
+        max(4 * len(compressed), 65536)
     )
-    dist_extra_bits_diffs = (
-        (0, 1), (0, 2), (0, 3), (0, 4),
-        (1, 5), (1, 7), (2, 9), (2, 13),
-        (3, 17), (3, 25), (4, 33), (4, 49),
-        (5, 65), (5, 97), (6, 129), (6, 193),
-        (7, 257), (7, 385), (8, 513), (8, 769),
-        (9, 1025), (9, 1537), (10, 2049), (10, 3073),
-        (11, 4097), (11, 6145), (12, 8193), (12, 12289),
-        (13, 16385), (13, 24577),
+    inflater = _stream_inflate(*_deflate_params[deflate64], min(max(len(uncompressed), 65536), 1048576), use_zlib=use_zlib)
+    compressed = (compressed,)
+    num_bytes = 0
+
+    try:
+        while True:
+            num_bytes += inflater.uncompressed_into(compressed, memoryview(uncompressed)[num_bytes:])
+            compressed = ()
+            if inflater.is_done():
+                break
+            if num_bytes != len(uncompressed):
+                raise TruncatedStream('Compressed input ended before the end of the stream')
+            uncompressed += bytes(max(len(uncompressed), 65536))
+
+        del uncompressed[num_bytes:]
+        return uncompressed, inflater.num_bytes_unconsumed()
+    finally:
+        # The decoder refers to the input until it's reset, and when compiled its functions are
+        # only freed by the garbage collector, which would stop an mmap from being closed
+        compressed = ()
+        inflater.reset()
+
+
+def stream_inflate_async(chunk_size=65536, use_zlib=False):
+    return _stream_inflate_async(stream_inflate(chunk_size, use_zlib=use_zlib))
+
+
+def stream_inflate64_async(chunk_size=65536):
+    return _stream_inflate_async(stream_inflate64(chunk_size))
+
+
+def _stream_inflate_async(inflater):
+    # Imported here since asyncio takes much longer to import than the rest of the module
+    import asyncio
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed = inflater
+
+    async def _uncompressed_chunks(compressed_chunks):
+        async for compressed_chunk in compressed_chunks:
+            for uncompressed_chunk in uncompressed_chunks((compressed_chunk,)):
+                yield uncompressed_chunk
+                # Decompression is CPU-bound, so give other tasks a chance to run between
+                # pages, even if the consumer of the pages doesn't itself suspend
+                await asyncio.sleep(0)
+            if is_done():
+                break
+
+    return _uncompressed_chunks, is_done, num_bytes_unconsumed
+
+
+def stream_inflate_parallel(compressed, executor=None, segment_size=1048576, max_segment_output_size=67108864):
+    return _stream_inflate_parallel(False, compressed, executor, segment_size, max_segment_output_size)
+
+
+def stream_inflate64_parallel(compressed, executor=None, segment_size=1048576, max_segment_output_size=67108864):
+    return _stream_inflate_parallel(True, compressed, executor, segment_size, max_segment_output_size)
+
+
+# A full flush ends with an empty stored block, which after its header is the bytes 00 00 FF FF,
+# and the blocks after it don't refer back to anything before it. The stream is split at these
+# bytes roughly every segment_size bytes, and the segments are uncompressed independently. The
+# bytes could also appear elsewhere, or be from a sync flush that doesn't reset the history, so
+# each split is only used if the segment before it ends exactly there at the end of a block, and
+# the segment after it doesn't refer back into it, and each segment is only uncompressed in a
+# worker up to max_segment_output_size, so workers never return too much at once. If not, the
+# stream is uncompressed serially, with the history from the segments before it, but only up to
+# the next split that is at the end of a block and where the worker's segment can be used
+def _stream_inflate_parallel(deflate64, compressed, executor, segment_size, max_segment_output_size):
+    # Imported here since it's only needed for this, and takes a while to import
+    from concurrent.futures import ProcessPoolExecutor
+
+    flush_marker = b'\x00\x00\xff\xff'
+    cache_size = _deflate_params[deflate64][2]
+    compressed_len = len(compressed)
+
+    starts = [0]
+    while True:
+        flush_marker_pos = compressed.find(flush_marker, starts[-1] + segment_size)
+        if flush_marker_pos == -1 or flush_marker_pos + len(flush_marker) == compressed_len:
+            break
+        starts.append(flush_marker_pos + len(flush_marker))
+    ends = starts[1:] + [compressed_len]
+
+    is_done = False
+    num_bytes_unconsumed = 0
+
+    def _uncompressed_chunks():
+        nonlocal is_done, num_bytes_unconsumed
+
+        # Without full flushes there's only one segment, so nothing to uncompress in parallel
+        if len(starts) == 1:
+            inflater = _stream_inflate(*_deflate_params[deflate64], 65536)
+            yield from inflater.uncompressed_chunks(slices(0, compressed_len))
+            is_done = inflater.is_done()
+            num_bytes_unconsumed = inflater.num_bytes_unconsumed()
+            return
+
+        _executor = ProcessPoolExecutor() if executor is None else executor
+        max_in_flight = 2 * (os.cpu_count() or 1)
+        futures = deque()
+        uncompressed_offset = 0
+        history = b''
+
+        # The decoder of segments being uncompressed serially, or None while using the workers'
+        inflater = None
+
+        def in_order():
+            # Keeps at most max_in_flight segments in progress, so that the uncompressed data
+            # isn't all in memory at once if the consumer is slower than the workers
+            for start, end in zip(starts, ends):
+                futures.append((start, end, _executor.submit(_inflate_segment, deflate64, compressed[start:end], end == compressed_len, max_segment_output_size)))
+                if len(futures) == max_in_flight:
+                    yield futures.popleft()
+            while futures:
+                yield futures.popleft()
+
+        try:
+            for start, end, future in in_order():
+                result = future.result()
+
+                if inflater is not None and result is not None:
+                    compressed_bit_offset, uncompressed_offset, history, state, b_final, _, _, _, match_remaining, _ = inflater.checkpoint()
+                    if state == 0 and not b_final and not match_remaining and compressed_bit_offset == start * 8:
+                        inflater = None
+
+                if inflater is None and result is not None:
+                    uncompressed, num_bytes_unconsumed = result
+                    yield uncompressed
+                    uncompressed_offset += len(uncompressed)
+                    history = (history + uncompressed[-cache_size:])[-cache_size:]
+                    continue
+
+                if inflater is None:
+                    inflater = _stream_inflate(*_deflate_params[deflate64], 65536, resume_from=(start * 8, uncompressed_offset, history))
+                yield from inflater.uncompressed_chunks(slices(start, end))
+
+                # The decoder doesn't count input passed after a call that it ends in
+                if inflater.is_done():
+                    is_done = True
+                    num_bytes_unconsumed = inflater.num_bytes_unconsumed() + compressed_len - end
+                    return
+
+            if inflater is None:
+                is_done = True
+            else:
+                num_bytes_unconsumed = inflater.num_bytes_unconsumed()
+        finally:
+            for _, _, future in futures:
+                future.cancel()
+            if executor is None:
+                _executor.shutdown()
+
+    # The serial decoder is passed a slice of the stream at a time rather than all of it at once,
+    # which for an mmap would read all of it into memory. The slices are copies, not views, so
+    # nothing left referring to them stops an mmap from being closed
+    def slices(start, end):
+        return (compressed[i:min(i + 65536, end)] for i in range(start, end, 65536))
+
+    def _is_done():
+        return is_done
+
+    def _num_bytes_unconsumed():
+        return num_bytes_unconsumed
+
+    return _uncompressed_chunks(), _is_done, _num_bytes_unconsumed
+
+
+def _inflate_segment(deflate64, segment, is_last, max_output_size):
+    # Run in a worker: returns None rather than raising if the segment doesn't look like it can
+    # be uncompressed on its own, or is larger than max_output_size uncompressed, since the serial
+    # fallback will raise if it's really an error
+    inflater = _stream_inflate(*_deflate_params[deflate64], 65536, max_output_size=max_output_size)
+    try:
+        uncompressed = b''.join(inflater.uncompressed_chunks((segment,)))
+    except StreamInflateError:
+        return None
+
+    if is_last:
+        return (uncompressed, inflater.num_bytes_unconsumed()) if inflater.is_done() else None
+
+    compressed_bit_offset, _, _, state, b_final, _, _, _, match_remaining, _ = inflater.checkpoint()
+    ends_at_block = state == 0 and not b_final and not match_remaining and compressed_bit_offset == len(segment) * 8
+    return (uncompressed, 0) if ends_at_block else None
+
+
+def stream_inflate_resumable(checkpoint=None, chunk_size=65536):
+    return _stream_inflate_resumable(False, checkpoint, chunk_size)
+
+
+def stream_inflate64_resumable(checkpoint=None, chunk_size=65536):
+    return _stream_inflate_resumable(True, checkpoint, chunk_size)
+
+
+# A checkpoint is the entire state of the decoder between uncompressed chunks: the position in
+# each stream, the position within the current block, the code lengths that define its Huffman
+# codes, and the window of recent uncompressed data
+_checkpoint_struct = Struct('<4sBBBBQQIIIHH')
+_checkpoint_magic = b'SICP'
+_checkpoint_version = 1
+
+
+def _stream_inflate_resumable(deflate64, checkpoint, chunk_size):
+    resume_from = None if checkpoint is None else _parse_checkpoint(deflate64, checkpoint)
+    inflater = _stream_inflate(*_deflate_params[deflate64], chunk_size, resume_from=resume_from)
+
+    def _checkpoint():
+        compressed_bit_offset, uncompressed_offset, history, state, b_final, stored_remaining, \
+            literal_stop_or_length_code_lengths, backwards_dist_code_lengths, match_remaining, match_dist = inflater.checkpoint()
+        return compressed_bit_offset // 8, uncompressed_offset, _checkpoint_struct.pack(
+            _checkpoint_magic, _checkpoint_version, deflate64, state, b_final,
+            compressed_bit_offset, uncompressed_offset, stored_remaining, match_remaining, match_dist,
+            len(literal_stop_or_length_code_lengths), len(backwards_dist_code_lengths),
+        ) + bytes(literal_stop_or_length_code_lengths) + bytes(backwards_dist_code_lengths) + zlib.compress(history)
+
+    return inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed, _checkpoint
+
+
+def _parse_checkpoint(deflate64, checkpoint):
+    checkpoint = memoryview(checkpoint)
+    if checkpoint[:len(_checkpoint_magic)] != _checkpoint_magic:
+        raise InvalidCheckpoint('Not a checkpoint')
+
+    try:
+        _, version, checkpoint_deflate64, state, b_final, compressed_bit_offset, uncompressed_offset, stored_remaining, \
+            match_remaining, match_dist, num_literal_stop_or_length_code_lengths, num_backwards_dist_code_lengths = \
+            _checkpoint_struct.unpack_from(checkpoint)
+    except struct_error:
+        raise InvalidCheckpoint('Checkpoint is truncated') from None
+
+    if version != _checkpoint_version:
+        raise InvalidCheckpoint('Unsupported checkpoint version {}'.format(version))
+
+    if checkpoint_deflate64 != deflate64:
+        raise InvalidCheckpoint('Checkpoint is from a Deflate64 stream' if checkpoint_deflate64 else 'Checkpoint is from a Deflate stream')
+
+    offset = _checkpoint_struct.size
+    literal_stop_or_length_code_lengths = tuple(checkpoint[offset:offset + num_literal_stop_or_length_code_lengths])
+    offset += num_literal_stop_or_length_code_lengths
+    backwards_dist_code_lengths = tuple(checkpoint[offset:offset + num_backwards_dist_code_lengths])
+    offset += num_backwards_dist_code_lengths
+
+    try:
+        history = zlib.decompress(checkpoint[offset:])
+    except zlib.error:
+        raise InvalidCheckpoint('Checkpoint is truncated') from None
+
+    return compressed_bit_offset, uncompressed_offset, history, state, b_final, stored_remaining, \
+        literal_stop_or_length_code_lengths, backwards_dist_code_lengths, match_remaining, match_dist
+
+
+def stream_inflate_index(compressed_chunks, span=1048576):
+    return _stream_inflate_index(False, compressed_chunks, span)
+
+
+def stream_inflate64_index(compressed_chunks, span=1048576):
+    return _stream_inflate_index(True, compressed_chunks, span)
+
+
+def stream_inflate_seek(index, offset, chunk_size=65536):
+    if offset < 0:
+        raise ValueError('offset must be at least 0')
+
+    deflate64, checkpoints = _parse_index(index)
+    compressed_bit_offset, uncompressed_offset, compressed_history = checkpoints[
+        bisect_right([uncompressed_offset for _, uncompressed_offset, _ in checkpoints], offset) - 1
+    ]
+    try:
+        history = zlib.decompress(compressed_history)
+    except zlib.error:
+        raise InvalidIndex('Index has an invalid history') from None
+
+    inflater = _stream_inflate(
+        *_deflate_params[deflate64], chunk_size,
+        resume_from=(compressed_bit_offset, uncompressed_offset, history),
+        skip=offset - uncompressed_offset,
     )
-    cache_size = 32768
-    return _stream_inflate(length_extra_bits_diffs, dist_extra_bits_diffs, cache_size, chunk_size)
-
-
-def stream_inflate64(chunk_size=65536):
-    length_extra_bits_diffs = (
-        (0, 3), (0, 4), (0, 5), (0, 6), (0, 7), (0, 8), (0, 9), (0, 10),
-        (1, 11), (1, 13), (1, 15), (1, 17),
-        (2, 19), (2, 23), (2, 27), (2, 31),
-        (3, 35), (3, 43), (3, 51), (3, 59),
-        (4, 67), (4, 83), (4, 99), (4, 115),
-        (5, 131), (5, 163), (5, 195), (5, 227),
-        (16, 3),
+
+    return compressed_bit_offset // 8, inflater.uncompressed_chunks, inflater.is_done, inflater.num_bytes_unconsumed
+
+
+# An index is a header, and then a checkpoint at the start of a block roughly every span bytes of
+# uncompressed data, each with the window of data before it that a resumed decoder needs
+_index_header_struct = Struct('<4sBBI')
+_index_checkpoint_struct = Struct('<QQI')
+_index_magic = b'SIIX'
+_index_version = 1
+
+
+def _stream_inflate_index(deflate64, compressed_chunks, span):
+    checkpoints = [(0, 0, zlib.compress(b''))]
+
+    def on_block_start(compressed_bit_offset, uncompressed_offset, history):
+        if uncompressed_offset - checkpoints[-1][1] >= span:
+            checkpoints.append((compressed_bit_offset, uncompressed_offset, zlib.compress(history)))
+
+    inflater = _stream_inflate(*_deflate_params[deflate64], 65536, on_block_start=on_block_start)
+    for _ in inflater.uncompressed_chunks(compressed_chunks):
+        pass
+    if not inflater.is_done():
+        raise TruncatedStream('Compressed input ended before the end of the stream')
+
+    return _index_header_struct.pack(_index_magic, _index_version, deflate64, len(checkpoints)) + b''.join(
+        _index_checkpoint_struct.pack(compressed_bit_offset, uncompressed_offset, len(compressed_history)) + compressed_history
+        for compressed_bit_offset, uncompressed_offset, compressed_history in checkpoints
     )
-    dist_extra_bits_diffs = (
-        (0, 1), (0, 2), (0, 3), (0, 4),
-        (1, 5), (1, 7), (2, 9), (2, 13),
-        (3, 17), (3, 25), (4, 33), (4, 49),
-        (5, 65), (5, 97), (6, 129), (6, 193),
-        (7, 257), (7, 385), (8, 513), (8, 769),
-        (9, 1025), (9, 1537), (10, 2049), (10, 3073),
-        (11, 4097), (11, 6145), (12, 8193), (12, 12289),
-        (13, 16385), (13, 24577), (14, 32769), (14, 49153),
+
+
+def _parse_index(index):
+    index = memoryview(index)
+    if index[:len(_index_magic)] != _index_magic:
+        raise InvalidIndex('Not an index')
+
+    try:
+        _, version, deflate64, num_checkpoints = _index_header_struct.unpack_from(index)
+        offset = _index_header_struct.size
+        checkpoints = []
+        for _ in range(0, num_checkpoints):
+            compressed_bit_offset, uncompressed_offset, compressed_history_len = _index_checkpoint_struct.unpack_from(index, offset)
+            offset += _index_checkpoint_struct.size
+            checkpoints.append((compressed_bit_offset, uncompressed_offset, bytes(index[offset:offset + compressed_history_len])))
+            offset += compressed_history_len
+    except struct_error:
+        raise InvalidIndex('Index is truncated') from None
+
+    if offset > len(index):
+        raise InvalidIndex('Index is truncated')
+
+    if version != _index_version:
+        raise InvalidIndex('Unsupported index version {}'.format(version))
+
+    # Every offset is found from the last checkpoint at or before it, so the first must be at 0
+    if not checkpoints or checkpoints[0][:2] != (0, 0):
+        raise InvalidIndex('Index has no checkpoint at the start of the stream')
+
+    return bool(deflate64), checkpoints
+
+
+# A queue of iterables of chunks of a container format, such as ZIP or gzip, that the chunks of
+# the compressed data inside it are passed from to a decompressor without buffering. Bytes are
+# only copied to parse headers and trailers, and any not yet needed are pushed back as memoryviews.
+# The most recent chunks passed to a decompressor are kept, so any bytes it doesn't consume can be
+# pushed back: a decompressor only holds on to at most 8 bytes before the last chunk passed to it
+def _get_chunk_queue():
+    iterables = deque()
+    it = None
+    pending = deque()
+    recent = deque()
+    recent_len = 0
+
+    def _append(iterable):
+        iterables.append(iterable)
+
+    def _next_view():
+        nonlocal it
+
+        while pending:
+            view = pending.popleft()
+            if view:
+                return view
+
+        while True:
+            if it is None:
+                if not iterables:
+                    return None
+                it = iter(iterables.popleft())
+
+            for chunk in it:
+                view = memoryview(chunk).cast('B')
+                if view:
+                    return view
+
+            it = None
+
+    def _push_back(view):
+        pending.appendleft(view)
+
+    # Up to num bytes, and fewer only if the current chunk has fewer, or if the input has run out
+    def _read(num):
+        view = _next_view()
+        if view is None:
+            return b''
+        if len(view) > num:
+            pending.appendleft(view[num:])
+            view = view[:num]
+        return view
+
+    def _yield_all():
+        nonlocal recent_len
+
+        while True:
+            view = _next_view()
+            if view is None:
+                return
+            recent.append(view)
+            recent_len += len(view)
+            while len(recent) > 1 and recent_len - len(view) - len(recent[0]) >= 8:
+                recent_len -= len(recent.popleft())
+            yield view
+
+    def _return_unconsumed(num):
+        nonlocal recent_len
+
+        while num:
+            view = recent.pop()
+            recent_len -= len(view)
+            num_from_view = min(num, len(view))
+            pending.appendleft(view[len(view) - num_from_view:])
+            num -= num_from_view
+
+    def _num_bytes_pending():
+        return sum(len(view) for view in pending)
+
+    return _append, _next_view, _push_back, _read, _yield_all, _return_unconsumed, _num_bytes_pending
+
+
+# Each member of a ZIP file starts with a local header, which is followed by the member's data,
+# and then, if its size wasn't known when the header was written, a data descriptor
+_zip_local_header_signature = b'PK\x03\x04'
+_zip_local_header_struct = Struct('<HHHHHIIIHH')
+_zip_extra_field_struct = Struct('<HH')
+_zip64_sizes_struct = Struct('<QQ')
+_zip_data_descriptor_signature = b'PK\x07\x08'
+
+
+def stream_inflate_zip(zip_chunks, chunk_size=65536, use_zlib=False, max_output_size=None, max_ratio=None):
+    append, next_view, push_back, read, yield_all, return_unconsumed, _ = _get_chunk_queue()
+    append(zip_chunks)
+
+    # A decompressor for each method, created when first needed and reset for each member after.
+    # As for gzip, their limits are for each member, but max_output_size is also checked here for
+    # all of them together, including those stored without compression
+    inflaters = {}
+    num_bytes_out = 0
+
+    def has_more():
+        view = next_view()
+        if view is None:
+            return False
+        push_back(view)
+        return True
+
+    def yield_num(num):
+        while num:
+            view = read(num)
+            if not view:
+                raise TruncatedStream('ZIP file ended before the end of a member')
+            num -= len(view)
+            yield view
+
+    def get_num(num):
+        return b''.join(yield_num(num))
+
+    def get_sizes(extra, compressed_size, uncompressed_size):
+        # The real sizes are in the Zip64 extra field if they don't fit in the header
+        extra = memoryview(extra)
+        while len(extra) >= _zip_extra_field_struct.size:
+            field_id, field_size = _zip_extra_field_struct.unpack_from(extra)
+            if field_id == 0x0001 and field_size >= _zip64_sizes_struct.size:
+                uncompressed_size, compressed_size = _zip64_sizes_struct.unpack_from(extra, _zip_extra_field_struct.size)
+                return True, compressed_size, uncompressed_size
+            extra = extra[_zip_extra_field_struct.size + field_size:]
+        return False, compressed_size, uncompressed_size
+
+    def limited(uncompressed_chunks):
+        nonlocal num_bytes_out
+
+        for uncompressed_chunk in uncompressed_chunks:
+            num_bytes_out += len(uncompressed_chunk)
+            if max_output_size is not None and num_bytes_out > max_output_size:
+                raise OutputLimitExceeded('Uncompressed more than {} bytes'.format(max_output_size))
+            yield uncompressed_chunk
+
+    def member_chunks(compression_method, has_data_descriptor, is_zip64, compressed_size):
+        if compression_method == 0:
+            yield from limited(yield_num(compressed_size))
+        else:
+            if compression_method not in inflaters:
+                inflaters[compression_method] = _stream_inflate(
+                    *_deflate_params[compression_method == 9], chunk_size,
+                    use_zlib=use_zlib and compression_method == 8, max_output_size=max_output_size, max_ratio=max_ratio,
+                )
+            inflater = inflaters[compression_method]
+            inflater.reset()
+            yield from limited(inflater.uncompressed_chunks(yield_all()))
+            if not inflater.is_done():
+                raise TruncatedStream('ZIP file ended before the end of a member')
+            return_unconsumed(inflater.num_bytes_unconsumed())
+
+        if has_data_descriptor:
+            # The signature is optional, so if it's not there the first 4 bytes are the CRC-32
+            num_after_crc_32 = 16 if is_zip64 else 8
+            get_num(num_after_crc_32 + (4 if get_num(4) == _zip_data_descriptor_signature else 0))
+
+    def members():
+        while has_more() and get_num(len(_zip_local_header_signature)) == _zip_local_header_signature:
+            _, flags, compression_method, _, _, crc_32, compressed_size, uncompressed_size, file_name_len, extra_len = \
+                _zip_local_header_struct.unpack(get_num(_zip_local_header_struct.size))
+            file_name = get_num(file_name_len)
+            is_zip64, compressed_size, uncompressed_size = get_sizes(get_num(extra_len), compressed_size, uncompressed_size)
+            has_data_descriptor = bool(flags & 0x08)
+
+            if flags & 0x01:
+                raise UnsupportedZipMember('Member {!r} is encrypted'.format(file_name))
+            if compression_method not in (0, 8, 9):
+                raise UnsupportedZipMember('Member {!r} has unsupported compression method {}'.format(file_name, compression_method))
+            if compression_method == 0 and has_data_descriptor:
+                raise UnsupportedZipMember('Member {!r} is stored without its size'.format(file_name))
+
+            uncompressed_chunks = member_chunks(compression_method, has_data_descriptor, is_zip64, compressed_size)
+            yield ZipMember(
+                file_name, compression_method, flags,
+                None if has_data_descriptor else crc_32,
+                None if has_data_descriptor else compressed_size,
+                None if has_data_descriptor else uncompressed_size,
+            ), uncompressed_chunks
+
+            # In case the caller didn't use all of the member, it has to be read to find the next
+            for _ in uncompressed_chunks:
+                pass
+
+    return members()
+
+
+def stream_inflate_zlib(chunk_size=65536, on_block=None, use_zlib=False, skip=0, max_output_size=None, max_ratio=None):
+    return _stream_inflate_wrapped(False, chunk_size, on_block, use_zlib, skip, max_output_size, max_ratio)
+
+
+def stream_inflate_gzip(chunk_size=65536, on_block=None, use_zlib=False, skip=0, max_output_size=None, max_ratio=None):
+    return _stream_inflate_wrapped(True, chunk_size, on_block, use_zlib, skip, max_output_size, max_ratio)
+
+
+def _zlib_header_num_bytes_needed(header):
+    return 2 - len(header)
+
+
+def _gzip_header_num_bytes_needed(header):
+    # The fixed part of the header says which of the variable length parts follow it. The file
+    # name and comment are terminated by a zero byte, so are read a byte at a time
+    if len(header) < 10:
+        return 10 - len(header)
+    if header[:3] != b'\x1f\x8b\x08':
+        raise InvalidHeader('Not a gzip member')
+
+    flags = header[3]
+    num_bytes = 10
+    if flags & 0x04:
+        if len(header) < num_bytes + 2:
+            return num_bytes + 2 - len(header)
+        num_bytes += 2 + int.from_bytes(header[num_bytes:num_bytes + 2], byteorder='little')
+        if len(header) < num_bytes:
+            return num_bytes - len(header)
+    for flag in (0x08, 0x10):
+        if flags & flag:
+            end = header.find(b'\x00', num_bytes)
+            if end == -1:
+                return 1
+            num_bytes = end + 1
+    if flags & 0x02:
+        num_bytes += 2
+
+    return num_bytes - len(header)
+
+
+def _check_zlib_header(header):
+    if header[0] & 0x0F != 8 or header[0] >> 4 > 7 or int.from_bytes(header, byteorder='big') % 31:
+        raise InvalidHeader('Not a zlib stream')
+    if header[1] & 0x20:
+        raise InvalidHeader('zlib streams with a preset dictionary are not supported')
+
+
+def _check_gzip_header(header):
+    if header[3] & 0xE0:
+        raise InvalidHeader('Reserved gzip flags are set')
+    if header[3] & 0x02 and zlib.crc32(header[:-2]) & 0xFFFF != int.from_bytes(header[-2:], byteorder='little'):
+        raise InvalidHeader('gzip header CRC does not match')
+
+
+# The front ends for zlib and gzip are state machines around a reusable Deflate decompressor,
+# since headers and trailers can be split across chunks, and across calls. The checksum is updated
+# from each uncompressed chunk as it's output, so checking it doesn't need another pass. A gzip
+# file can have several members: at the end of each is_done is true, but if more input starts
+# another member then it's uncompressed too. The skipped bytes still have to be in the checksum, so
+# rather than by the Deflate decompressor they're skipped here. The decompressor's limits are for
+# each member, and since its ratio is then at most max_ratio so is the ratio of all of them, but
+# max_output_size is also checked here for all of them together
+def _stream_inflate_wrapped(is_gzip, chunk_size, on_block, use_zlib, skip, max_output_size, max_ratio):
+    if skip < 0:
+        raise ValueError('skip must be at least 0')
+
+    append, next_view, push_back, read, yield_all, return_unconsumed, num_bytes_pending = _get_chunk_queue()
+    inflater = _stream_inflate(
+        *_deflate_params[False], chunk_size,
+        on_block=on_block, use_zlib=use_zlib, max_output_size=max_output_size, max_ratio=max_ratio,
     )
-    cache_size = 65536
-    return _stream_inflate(length_extra_bits_diffs, dist_extra_bits_diffs, cache_size, chunk_size)
-
-
-def _stream_inflate(length_extra_bits_diffs, dist_extra_bits_diffs, cache_size, chunk_size):
-    literal_stop_or_length_code_lengths = \
-        (8,) * 144 + \
-        (9,) * 112 + \
-        (7,) * 24 + \
-        (8,) * 8
-    dist_code_lengths = \
-        (5,) * 32
+    header_num_bytes_needed, check_header, checksum_func, trailer_len = \
+        (_gzip_header_num_bytes_needed, _check_gzip_header, zlib.crc32, 8) if is_gzip else \
+        (_zlib_header_num_bytes_needed, _check_zlib_header, zlib.adler32, 4)
+
+    # 0: in the header, 1: in the compressed data, 2: in the trailer, 3: at the end of a member
+    state = 0
+    header = bytearray()
+    trailer = bytearray()
+    checksum = checksum_func(b'')
+    num_bytes_out = 0
+    num_bytes_out_all = 0
+    num_to_skip = skip
+
+    def _run(new_iterable):
+        nonlocal state, header, trailer, checksum, num_bytes_out, num_bytes_out_all, num_to_skip
+
+        append(new_iterable)
+
+        while True:
+            if state == 3:
+                # Only gzip has multiple members, and anything else after the end is not part of it.
+                # Another member is only started once all of its 2 byte magic has been seen, and
+                # until then the bytes are left pending, so is_done stays true
+                view = next_view() if is_gzip else None
+                if view is None:
+                    return
+                magic = bytes(view[:2])
+                if magic == b'\x1f':
+                    view_after = next_view()
+                    if view_after is not None:
+                        push_back(view_after)
+                        magic += bytes(view_after[:1])
+                push_back(view)
+                if magic != b'\x1f\x8b':
+                    return
+                header = bytearray()
+                state = 0
+
+            if state == 0:
+                num_bytes = header_num_bytes_needed(header)
+                while num_bytes:
+                    view = read(num_bytes)
+                    if not view:
+                        return
+                    header += view
+                    num_bytes = header_num_bytes_needed(header)
+                check_header(header)
+                inflater.reset()
+                checksum = checksum_func(b'')
+                num_bytes_out = 0
+                state = 1
+
+            if state == 1:
+                for uncompressed_chunk in inflater.uncompressed_chunks(yield_all()):
+                    checksum = checksum_func(uncompressed_chunk, checksum)
+                    num_bytes_out += len(uncompressed_chunk)
+                    num_bytes_out_all += len(uncompressed_chunk)
+                    if max_output_size is not None and num_bytes_out_all > max_output_size:
+                        raise OutputLimitExceeded('Uncompressed more than {} bytes'.format(max_output_size))
+                    if num_to_skip:
+                        num_skipped = min(num_to_skip, len(uncompressed_chunk))
+                        num_to_skip -= num_skipped
+                        uncompressed_chunk = uncompressed_chunk[num_skipped:]
+                        if not uncompressed_chunk:
+                            continue
+                    yield uncompressed_chunk
+                if not inflater.is_done():
+                    return
+                return_unconsumed(inflater.num_bytes_unconsumed())
+                trailer = bytearray()
+                state = 2
+
+            if state == 2:
+                while len(trailer) != trailer_len:
+                    view = read(trailer_len - len(trailer))
+                    if not view:
+                        return
+                    trailer += view
+                expected_checksum, expected_size = \
+                    (int.from_bytes(trailer[:4], byteorder='little'), int.from_bytes(trailer[4:], byteorder='little')) if is_gzip else \
+                    (int.from_bytes(trailer, byteorder='big'), num_bytes_out & 0xFFFFFFFF)
+                if checksum != expected_checksum:
+                    raise InvalidChecksum('Checksum {:08x} does not match expected {:08x}'.format(checksum, expected_checksum))
+                if num_bytes_out & 0xFFFFFFFF != expected_size:
+                    raise InvalidChecksum('Size {} does not match expected {} modulo 2^32'.format(num_bytes_out, expected_size))
+                state = 3
+
+    def _is_done():
+        return state == 3
+
+    return _run, _is_done, num_bytes_pending
+
+
+def _stream_inflate(length_extra_bits_diffs, dist_extra_bits_diffs, cache_size, chunk_size, on_block_start=None, on_block=None, resume_from=None, use_zlib=False, skip=0, split_at_flush=False, max_output_size=None, max_ratio=None):
+    if use_zlib and (on_block_start is not None or on_block is not None or resume_from is not None):
+        raise ValueError('on_block_start, on_block and resume_from are not supported with use_zlib')
+    if skip < 0:
+        raise ValueError('skip must be at least 0')
+
     code_lengths_alphabet = (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15)
+    limited = max_output_size is not None or max_ratio is not None
 
-    # An object that can be seen as a "deferred" that can pause a generator, with
-    # the extra abiliy to yield values by the generator "runner".
-    DeferredYielder = namedtuple('DeferredYielder', (
-        'can_proceed',
-        'to_yield',
-        'return_value',
-    ))
-    def _true():
-        return True
-    def _none():
-        return None
+    # The decoders never uncompress more than one byte past max_output_size, so a back-reference
+    # that would take the output past it is never copied in full. The ratio is only checked once
+    # per call to a decoder, which uncompresses at most chunk_size bytes
+    def check_limits(num_bytes_out, num_bytes_in):
+        if max_output_size is not None and num_bytes_out > max_output_size:
+            raise OutputLimitExceeded('Uncompressed more than {} bytes'.format(max_output_size))
+        if max_ratio is not None and num_bytes_out > max_ratio * num_bytes_in:
+            raise OutputLimitExceeded('Uncompressed {} bytes from {} bytes, more than {} times as many'.format(num_bytes_out, num_bytes_in, max_ratio))
 
     def get_iterable_queue():
-        next_it = None
+        next_its = deque()
         it = None
 
         def _append(iterable):
-            nonlocal next_it
-            next_it = iterable
+            next_its.append(iterable)
 
         def _next():
-            nonlocal next_it, it
+            nonlocal it
 
             while True:
                 if it is None:
-                    if next_it is None:
+                    if not next_its:
                         raise StopIteration() from None
-                    it = iter(next_it)
-                    next_it = None
+                    it = iter(next_its.popleft())
 
                 try:
                     return next(it)
                 except StopIteration:
                     it = None
 
-        return _append, _next
+        def _clear():
+            nonlocal it
 
-    # Low level bit/byte readers
-    def get_readers(it_next):
-        chunk: bytes = b''
-        chunk_len = 0
-        offset_byte = 0
-        offset_bit = 0
+            next_its.clear()
+            it = None
 
-        def _has_bit():
-            nonlocal chunk, chunk_len, offset_byte, offset_bit
+        return _append, _next, _clear
 
-            if offset_bit == 8:
-                offset_bit = 0
-                offset_byte += 1
+    # The decoder is a state machine that writes uncompressed bytes straight into an output
+    # buffer, and only returns when the buffer is full, the input has run out, or the stream has
+    # ended. Its state is always at a symbol boundary, and is resumed on the next call
+    def get_decoder(it_next):
+        _len = len
 
-            if offset_byte == chunk_len:
+        # Huffman codes for values past the end of the extra bits tables are treated as invalid
+        num_literal_stop_or_length_values = 257 + len(length_extra_bits_diffs)
+        num_dist_values = len(dist_extra_bits_diffs)
+        fixed_dist_codes = _fixed_dist_codes[num_dist_values]
+
+        # Bits are accumulated in bit_buf, least significant first, several bytes at a time from
+        # the current chunk, so they can be peeked at, and only consumed once a whole symbol
+        # (and any extra bits) is known to be available
+        chunk = b''
+        chunk_len = 0
+        offset_byte = 0
+        bit_buf = 0
+        bit_cnt = 0
+
+        # Positions in the compressed and uncompressed streams as a whole, and the number of bits
+        # to skip when resuming from the middle of a byte
+        num_bytes_before_chunk = 0
+        num_bytes_out = 0
+        skip_bits = 0
+
+        # A linear buffer of uncompressed bytes, where the cache_size bytes before window_pos are the
+        # most recent in the stream, and the bytes after are where bytes are decoded into. It's
+        # at least twice cache_size so that any back-reference is one contiguous read and write,
+        # and only when the space after window_pos runs out are the recent bytes moved to the start
+        window_size = 2 * cache_size + chunk_size
+        window = bytearray(window_size)
+        window_pos = 0
+
+        # 0: at the start of a block, 1: in a stored block, 2: in a Huffman block, 3: done
+        state = 0
+        b_final = 0
+        stored_remaining = 0
+        literal_stop_or_length_codes = None
+        backwards_dist_codes = None
+        literal_stop_or_length_code_lengths = ()
+        backwards_dist_code_lengths = ()
+
+        # A back-reference that didn't fit in the output buffer
+        match_remaining = 0
+        match_dist = 0
+
+        # The number of bytes just before offset_byte in the current chunk that have been returned
+        # as views of a stored block, but not yet copied into the window. Only the last cache_size
+        # of them are ever copied, and only when the window is next needed or the block ends
+        num_bytes_viewed = 0
+
+        # If the last call stopped at an empty non-final stored block, as written by a sync or
+        # full flush, which only happens if split_at_flush is set
+        at_flush = False
+
+        # Statistics of the current block, only collected if on_block is passed
+        block_compressed_start = 0
+        block_uncompressed_start = 0
+        block_num_matches = 0
+        block_num_match_bytes = 0
+        block_header_seconds = 0.0
+        block_decode_seconds = 0.0
+
+        def fill_bits(num):
+            nonlocal offset_byte, bit_buf, bit_cnt
+
+            while bit_cnt < num and has_more():
+                num_bytes = min((num - bit_cnt + 7) // 8, chunk_len - offset_byte)
+                bit_buf |= int.from_bytes(chunk[offset_byte:offset_byte + num_bytes], byteorder='little') << bit_cnt
+                bit_cnt += num_bytes * 8
+                offset_byte += num_bytes
+
+            return bit_cnt
+
+        def has_more():
+            nonlocal chunk, chunk_len, offset_byte, num_bytes_before_chunk
+
+            while offset_byte == chunk_len:
                 try:
-                    chunk = it_next()
+                    next_chunk = it_next()
                 except StopIteration:
                     return False
                 else:
-                    chunk_len = len(chunk)
+                    num_bytes_before_chunk += chunk_len
+                    chunk = next_chunk
+                    chunk_len = _len(chunk)
                     offset_byte = 0
-                    offset_bit = 0
 
             return True
 
-        def _has_byte():
-            nonlocal chunk, offset_byte, offset_bit
-
-            if offset_bit:
-                offset_byte += 1
-            offset_bit = 0
-
-            return _has_bit()
-
-        def _get_bit():
-            nonlocal offset_bit
-            offset_bit += 1
+        def make_space(num):
+            nonlocal window_pos
 
-            return (chunk[offset_byte] & (2 ** (offset_bit - 1))) >> (offset_bit - 1)
+            if window_pos + num > window_size:
+                num_to_keep = window_pos if window_pos < cache_size else cache_size
+                window[0:num_to_keep] = window[window_pos - num_to_keep:window_pos]
+                window_pos = num_to_keep
 
-        def _get_byte():
-            nonlocal offset_byte
-            offset_byte += 1
-            return chunk[offset_byte - 1]
+        def copy_match(out_pos, dist, length):
+            # Copies length bytes from dist bytes back in the stream, repeating them if they overlap
+            # with the bytes being copied to
+            if dist > out_pos:
+                raise BackwardsTooFar('Looking backwards {} bytes but only {} bytes in stream so far'.format(dist, out_pos))
 
-        def _yield_bytes_up_to(num):
-            nonlocal chunk, chunk_len, offset_byte
+            if dist >= length:
+                window[out_pos:out_pos + length] = window[out_pos - dist:out_pos - dist + length]
+            else:
+                parts = window[out_pos - dist:out_pos]
+                num_repeats = length // dist
+                window[out_pos:out_pos + length] = parts * num_repeats + parts[:length - num_repeats * dist]
+
+        def read_block_header():
+            # Only consumes the bits of the header if all of them are available, returning
+            # False if not
+            nonlocal bit_buf, bit_cnt, state, b_final, stored_remaining, literal_stop_or_length_codes, backwards_dist_codes
+            nonlocal literal_stop_or_length_code_lengths, backwards_dist_code_lengths
+            cursor = 0
+
+            def get_bits(num_bits):
+                nonlocal cursor
+                if fill_bits(cursor + num_bits) < cursor + num_bits:
+                    raise _NotEnoughInput()
+                bits = (bit_buf >> cursor) & ((1 << num_bits) - 1)
+                cursor += num_bits
+                return bits
+
+            def get_huffman_value(codes):
+                nonlocal cursor
+                table, root_bits, _ = codes
+                num_bits = fill_bits(cursor + 15) - cursor
+                bits = bit_buf >> cursor
+                entry = table[bits & ((1 << root_bits) - 1)]
+                if entry & 16:
+                    entry = table[(entry >> 5) + ((bits >> root_bits) & ((1 << (entry & 15)) - 1))]
+                length = entry & 15
+                if not length and num_bits >= 15:
+                    raise InvalidHuffmanCode('Sequence of bits {:015b} is not a Huffman code'.format(bits & 0x7FFF))
+                if not length or length > num_bits:
+                    raise _NotEnoughInput()
+                cursor += length
+                return entry >> 5
+
+            def get_code_lengths(code_length_codes, num_codes):
+                result = [0] * num_codes
+
+                i = 0
+                previous = None
+                while i < num_codes:
+                    code = get_huffman_value(code_length_codes)
+                    if code < 16:
+                        previous = code
+                        result[i] = code
+                        i += 1
+                        continue
+
+                    if code == 16:
+                        num_repeats = 3 + get_bits(2)
+                        if previous is None:
+                            raise InvalidHuffmanCode('Code length repeat code 16 with no previous code length')
+                    elif code == 17:
+                        num_repeats = 3 + get_bits(3)
+                        previous = 0
+                    else:
+                        num_repeats = 11 + get_bits(7)
+                        previous = 0
+                    if i + num_repeats > num_codes:
+                        raise InvalidHuffmanCode('Code length repeat code {} repeats {} times past the {} code lengths'.format(code, i + num_repeats - num_codes, num_codes))
+                    result[i:i + num_repeats] = (previous,) * num_repeats
+                    i += num_repeats
+
+                return result
+
+            try:
+                header_b_final = get_bits(1)
+                b_type = get_bits(2)
+
+                if b_type == 3:
+                    raise UnsupportedBlockType(b_type)
+
+                if b_type == 0:
+                    # Stored blocks start at a byte boundary. Since bits are accumulated in whole
+                    # bytes, the number of bits from the current partial byte is the remainder
+                    cursor += (bit_cnt - cursor) % 8
+                    header_stored_remaining = get_bits(16)
+                    get_bits(16)
+                elif b_type == 1:
+                    header_literal_stop_or_length_code_lengths = _fixed_literal_stop_or_length_code_lengths
+                    header_backwards_dist_code_lengths = _fixed_dist_code_lengths
+                    header_literal_stop_or_length_codes = _fixed_literal_stop_or_length_codes
+                    header_backwards_dist_codes = fixed_dist_codes
+                else:
+                    num_literal_length_codes = get_bits(5) + 257
+                    num_dist_codes = get_bits(5) + 1
+                    num_length_codes = get_bits(4) + 4
+
+                    code_length_code_lengths = tuple(get_bits(3) for _ in range(0, num_length_codes)) + ((0,) * (19 - num_length_codes))
+                    code_length_code_lengths = tuple(
+                        v for i, v in
+                        sorted(enumerate(code_length_code_lengths), key=lambda x: code_lengths_alphabet[x[0]])
+                    )
+                    code_length_codes = _get_huffman_codes(code_length_code_lengths, 7, 19)
+
+                    dynamic_code_lengths = get_code_lengths(code_length_codes, num_literal_length_codes + num_dist_codes)
+                    header_literal_stop_or_length_code_lengths = tuple(dynamic_code_lengths[:num_literal_length_codes])
+                    header_backwards_dist_code_lengths = tuple(dynamic_code_lengths[num_literal_length_codes:])
+
+                    header_literal_stop_or_length_codes = _get_huffman_codes(header_literal_stop_or_length_code_lengths, 9, num_literal_stop_or_length_values)
+                    header_backwards_dist_codes = _get_huffman_codes(header_backwards_dist_code_lengths, 6, num_dist_values)
+            except _NotEnoughInput:
+                return False
+
+            bit_buf >>= cursor
+            bit_cnt -= cursor
+            b_final = header_b_final
+            if b_type == 0:
+                state = 1
+                stored_remaining = header_stored_remaining
+            else:
+                state = 2
+                literal_stop_or_length_codes = header_literal_stop_or_length_codes
+                backwards_dist_codes = header_backwards_dist_codes
+                literal_stop_or_length_code_lengths = header_literal_stop_or_length_code_lengths
+                backwards_dist_code_lengths = header_backwards_dist_code_lengths
 
-            # This is only ever used when we have an uncompressed block, just after we have
-            # fetched the size of the block as whole bytes. So we don't need to worry about bits
-            # here: we are already on a byte boundary
+            return True
 
-            while num:
-                if offset_byte == chunk_len:
-                    try:
-                        chunk = it_next()
-                    except StopIteration:
-                        return
-                    chunk_len = len(chunk)
-                    offset_byte = 0
-                to_yield = min(num, len(chunk) - offset_byte)
-                offset_byte += to_yield
-                num -= to_yield
-                yield chunk[offset_byte - to_yield:offset_byte]
+        def copy_stored(out_pos, out_end):
+            nonlocal offset_byte, bit_buf, bit_cnt, stored_remaining
+
+            # There could be whole bytes that have been accumulated but not yet consumed
+            while stored_remaining and out_pos != out_end and bit_cnt:
+                window[out_pos] = bit_buf & 0xFF
+                bit_buf >>= 8
+                bit_cnt -= 8
+                stored_remaining -= 1
+                out_pos += 1
+
+            while stored_remaining and out_pos != out_end and has_more():
+                num_bytes = min(stored_remaining, out_end - out_pos, chunk_len - offset_byte)
+                window[out_pos:out_pos + num_bytes] = memoryview(chunk)[offset_byte:offset_byte + num_bytes]
+                offset_byte += num_bytes
+                stored_remaining -= num_bytes
+                out_pos += num_bytes
+
+            return out_pos
+
+        # The extra bits tables as arrays, only used by _copy_huffman_fast
+        length_extra_bits = array('B', (extra_bits for extra_bits, _ in length_extra_bits_diffs))
+        length_diffs = array('I', (diff for _, diff in length_extra_bits_diffs))
+        dist_extra_bits = array('B', (extra_bits for extra_bits, _ in dist_extra_bits_diffs))
+        dist_diffs = array('I', (diff for _, diff in dist_extra_bits_diffs))
+
+        def copy_huffman(out_pos, out_end):
+            # When compiled, most symbols are decoded by _copy_huffman_fast, and copy_huffman_slow
+            # is only used at the end of each input chunk, where a symbol may be split across chunks
+            while True:
+                if _fast_huffman:
+                    out_pos = copy_huffman_fast(out_pos, out_end)
+                    if state != 2 or out_pos == out_end or match_remaining:
+                        return out_pos
+
+                out_pos = copy_huffman_slow(out_pos, out_end)
+                if not _fast_huffman or state != 2 or out_pos == out_end or match_remaining or chunk_len - offset_byte < 16:
+                    return out_pos
+
+        def copy_huffman_fast(out_pos, out_end):
+            nonlocal offset_byte, bit_buf, bit_cnt, state, match_remaining, match_dist
+            nonlocal block_num_matches, block_num_match_bytes
+
+            # The fast path takes at most 64 bits, so any more are given back to the current chunk,
+            # which is where the most recently accumulated bits are from
+            if bit_cnt > 64:
+                num_bytes_back = (bit_cnt - 57) // 8
+                if num_bytes_back > offset_byte:
+                    return out_pos
+                offset_byte -= num_bytes_back
+                bit_cnt -= num_bytes_back * 8
+                bit_buf &= (1 << bit_cnt) - 1
+
+            out_pos, offset_byte, bit_buf, bit_cnt, end_of_block, match_remaining, match_dist, num_matches, num_match_bytes = _copy_huffman_fast(
+                window, out_pos, out_end, chunk, offset_byte, bit_buf, bit_cnt,
+                literal_stop_or_length_codes[2], literal_stop_or_length_codes[1], backwards_dist_codes[2], backwards_dist_codes[1],
+                length_extra_bits, length_diffs, dist_extra_bits, dist_diffs,
+            )
+            if end_of_block:
+                state = 0
+            block_num_matches += num_matches
+            block_num_match_bytes += num_match_bytes
+            return out_pos
+
+        def copy_huffman_slow(out_pos, out_end):
+            nonlocal chunk, chunk_len, offset_byte, bit_buf, bit_cnt, state, match_remaining, match_dist
+            nonlocal block_num_matches, block_num_match_bytes
+
+            _window = window
+            _length_extra_bits_diffs = length_extra_bits_diffs
+            _dist_extra_bits_diffs = dist_extra_bits_diffs
+            literal_stop_or_length_table, literal_stop_or_length_root_bits, _ = literal_stop_or_length_codes
+            backwards_dist_table, backwards_dist_root_bits, _ = backwards_dist_codes
+            literal_stop_or_length_mask = (1 << literal_stop_or_length_root_bits) - 1
+            backwards_dist_mask = (1 << backwards_dist_root_bits) - 1
+
+            # Local copies of the reader state for speed in the loop, stored back before returning
+            # or calling anything that uses them
+            _chunk = chunk
+            _chunk_len = chunk_len
+            _offset_byte = offset_byte
+            _bit_buf = bit_buf
+            _bit_cnt = bit_cnt
+
+            # Only back-references are counted: literals are the rest of the block's bytes
+            _counting = on_block is not None
+            _num_matches = 0
+            _num_match_bytes = 0
+
+            while out_pos != out_end:
+                if _bit_cnt < 64:
+                    if _offset_byte + 8 <= _chunk_len:
+                        _bit_buf |= int.from_bytes(_chunk[_offset_byte:_offset_byte + 8], byteorder='little') << _bit_cnt
+                        _bit_cnt += 64
+                        _offset_byte += 8
+                    else:
+                        chunk, chunk_len, offset_byte, bit_buf, bit_cnt = _chunk, _chunk_len, _offset_byte, _bit_buf, _bit_cnt
+                        fill_bits(64)
+                        _chunk, _chunk_len, _offset_byte, _bit_buf, _bit_cnt = chunk, chunk_len, offset_byte, bit_buf, bit_cnt
+                        if _fast_huffman and _chunk_len - _offset_byte >= 16:
+                            break
 
-        def _num_bytes_unconsumed():
-            return len(chunk) - offset_byte - (1 if offset_bit else 0)
+                entry = literal_stop_or_length_table[_bit_buf & literal_stop_or_length_mask]
+                if entry & 16:
+                    entry = literal_stop_or_length_table[(entry >> 5) + ((_bit_buf >> literal_stop_or_length_root_bits) & ((1 << (entry & 15)) - 1))]
+                num_bits = entry & 15
+                if not num_bits or num_bits > _bit_cnt:
+                    if not num_bits and _bit_cnt >= 15:
+                        raise InvalidHuffmanCode('Sequence of bits {:015b} is not a Huffman code'.format(_bit_buf & 0x7FFF))
+                    break
 
-        return _has_bit, _has_byte, _get_bit, _get_byte, _yield_bytes_up_to, _num_bytes_unconsumed
+                literal_stop_or_length_code = entry >> 5
+                if literal_stop_or_length_code < 256:
+                    _window[out_pos] = literal_stop_or_length_code
+                    out_pos += 1
+                    _bit_buf >>= num_bits
+                    _bit_cnt -= num_bits
+                    continue
+
+                if literal_stop_or_length_code == 256:
+                    _bit_buf >>= num_bits
+                    _bit_cnt -= num_bits
+                    state = 0
+                    break
 
-    # Bit/byte readers that are DeferredYielder
-    def get_deferred_yielder_readers(reader_has_bit, reader_has_byte, reader_get_bit, reader_get_byte, reader_yield_bytes_up_to):
+                length_extra_bits, length_diff = _length_extra_bits_diffs[literal_stop_or_length_code - 257]
+                length = length_diff + ((_bit_buf >> num_bits) & ((1 << length_extra_bits) - 1))
+                num_bits += length_extra_bits
+
+                bits = _bit_buf >> num_bits
+                entry = backwards_dist_table[bits & backwards_dist_mask]
+                if entry & 16:
+                    entry = backwards_dist_table[(entry >> 5) + ((bits >> backwards_dist_root_bits) & ((1 << (entry & 15)) - 1))]
+                if not (entry & 15) or num_bits + (entry & 15) > _bit_cnt:
+                    if not (entry & 15) and _bit_cnt - num_bits >= 15:
+                        raise InvalidHuffmanCode('Sequence of bits {:015b} is not a Huffman code'.format(bits & 0x7FFF))
+                    break
+                num_bits += entry & 15
 
-        get_bit = DeferredYielder(can_proceed=reader_has_bit, to_yield=None, return_value=reader_get_bit)
-        get_byte = DeferredYielder(can_proceed=reader_has_byte, to_yield=None, return_value=reader_get_byte)
+                dist_extra_bits, dist_diff = _dist_extra_bits_diffs[entry >> 5]
+                dist = dist_diff + ((_bit_buf >> num_bits) & ((1 << dist_extra_bits) - 1))
+                num_bits += dist_extra_bits
+                if num_bits > _bit_cnt:
+                    break
 
-        def get_bits(num_bits):
-            out = 0
-            out_offset_bit = 0
+                _bit_buf >>= num_bits
+                _bit_cnt -= num_bits
+                if _counting:
+                    _num_matches += 1
+                    _num_match_bytes += length
 
-            for out_offset_bit in range(0, num_bits):
-                out |= (reader_get_bit() if reader_has_bit() else (yield get_bit)) << out_offset_bit
+                if length > out_end - out_pos:
+                    match_remaining = length - (out_end - out_pos)
+                    match_dist = dist
+                    length = out_end - out_pos
 
-            return out
+                if dist <= out_pos and dist >= length:
+                    _window[out_pos:out_pos + length] = _window[out_pos - dist:out_pos - dist + length]
+                else:
+                    copy_match(out_pos, dist, length)
+                out_pos += length
+
+            chunk, chunk_len, offset_byte, bit_buf, bit_cnt = _chunk, _chunk_len, _offset_byte, _bit_buf, _bit_cnt
+            if _counting:
+                block_num_matches += _num_matches
+                block_num_match_bytes += _num_match_bytes
+            return out_pos
+
+        block_start_hook = on_block_start
+
+        if on_block is not None:
+            # The functions that work on whole blocks are wrapped to time them and report on each
+            # block when it ends, so there is no cost when statistics aren't requested
+            _read_block_header, _copy_stored, _copy_huffman, _block_start_hook = read_block_header, copy_stored, copy_huffman, block_start_hook
+
+            def block_start_hook(compressed_bit_offset, uncompressed_offset, history):
+                nonlocal block_compressed_start, block_uncompressed_start
+                block_compressed_start = compressed_bit_offset
+                block_uncompressed_start = uncompressed_offset
+                if _block_start_hook is not None:
+                    _block_start_hook(compressed_bit_offset, uncompressed_offset, history)
+
+            def read_block_header():
+                nonlocal block_header_seconds
+                start = perf_counter()
+                try:
+                    return _read_block_header()
+                finally:
+                    block_header_seconds += perf_counter() - start
+
+            def copy_stored(out_pos, out_end):
+                nonlocal block_decode_seconds
+                start = perf_counter()
+                out_pos = _copy_stored(out_pos, out_end)
+                block_decode_seconds += perf_counter() - start
+                if not stored_remaining:
+                    end_block('stored', out_pos)
+                return out_pos
+
+            def copy_huffman(out_pos, out_end):
+                nonlocal block_decode_seconds
+                start = perf_counter()
+                out_pos = _copy_huffman(out_pos, out_end)
+                block_decode_seconds += perf_counter() - start
+                if state == 0:
+                    end_block('fixed' if literal_stop_or_length_codes is _fixed_literal_stop_or_length_codes else 'dynamic', out_pos)
+                return out_pos
+
+            def end_block(block_type, out_pos):
+                nonlocal block_num_matches, block_num_match_bytes, block_header_seconds, block_decode_seconds
+                uncompressed_end = num_bytes_out + out_pos - window_pos
+                num_literals = uncompressed_end - block_uncompressed_start - block_num_match_bytes if block_type != 'stored' else 0
+                on_block(BlockStats(
+                    block_type, bool(b_final),
+                    block_compressed_start, compressed_bit_offset(),
+                    block_uncompressed_start, uncompressed_end,
+                    num_literals, block_num_matches, block_num_match_bytes / block_num_matches if block_num_matches else 0.0,
+                    block_header_seconds, block_decode_seconds,
+                ))
+                block_num_matches = 0
+                block_num_match_bytes = 0
+                block_header_seconds = 0.0
+                block_decode_seconds = 0.0
+
+        def _decode(num):
+            # Returns a view of up to num newly uncompressed bytes, only valid until the next call.
+            # This is fewer than num only if the input has run out, the stream has ended, or if
+            # split_at_flush is set, a flush was reached
+            nonlocal bit_buf, bit_cnt, skip_bits, state, match_remaining, window_pos, num_bytes_out, at_flush
+
+            at_flush = False
+            copy_viewed()
+
+            if skip_bits:
+                if fill_bits(skip_bits) < skip_bits:
+                    return memoryview(window)[window_pos:window_pos]
+                bit_buf >>= skip_bits
+                bit_cnt -= skip_bits
+                skip_bits = 0
+
+            make_space(num)
+            out_pos = window_pos
+            out_end = window_pos + num
+            if max_output_size is not None and max_output_size + 1 - num_bytes_out < num:
+                out_end = window_pos + max_output_size + 1 - num_bytes_out
+
+            while out_pos != out_end:
+                if match_remaining:
+                    length = match_remaining if match_remaining < out_end - out_pos else out_end - out_pos
+                    copy_match(out_pos, match_dist, length)
+                    match_remaining -= length
+                    out_pos += length
+                elif state == 0:
+                    if b_final:
+                        state = 3
+                        break
+                    if block_start_hook is not None:
+                        block_start_hook(
+                            compressed_bit_offset(),
+                            num_bytes_out + out_pos - window_pos,
+                            memoryview(window)[out_pos - cache_size if out_pos > cache_size else 0:out_pos],
+                        )
+                    if not read_block_header():
+                        break
+                    if split_at_flush and state == 1 and not stored_remaining and not b_final:
+                        state = 0
+                        at_flush = True
+                        break
+                elif state == 1:
+                    out_pos = copy_stored(out_pos, out_end)
+                    if not stored_remaining:
+                        state = 0
+                    elif out_pos != out_end:
+                        break
+                elif state == 2:
+                    out_pos = copy_huffman(out_pos, out_end)
+                    if state == 2 and out_pos != out_end and not match_remaining:
+                        break
+                else:
+                    break
 
-        def get_bits_as_bytes(num_bits):
-            out: bytearray = bytearray(-(-num_bits // 8))
-            out_offset_bit = 0
+            # The final block could have ended just as the requested number of bytes was reached
+            if state == 0 and b_final and not match_remaining:
+                state = 3
+
+            out_start = window_pos
+            window_pos = out_pos
+            num_bytes_out += out_pos - out_start
+            if limited:
+                check_limits(num_bytes_out, (compressed_bit_offset() + 7) // 8)
+            return memoryview(window)[out_start:out_pos]
+
+        def _stored_view(num):
+            # A view of up to num bytes of a stored block, ending early at the end of the block or
+            # of the current chunk. Before moving on to the next chunk, the bytes already viewed in
+            # the current one are copied into the window, since they're only contiguous in it
+            nonlocal offset_byte, stored_remaining, num_bytes_out, num_bytes_viewed
+
+            if skip_bits or match_remaining:
+                return None
+            if state != 1 or not stored_remaining:
+                next_block()
+            if state != 1 or bit_cnt or not stored_remaining:
+                return None
+            if offset_byte == chunk_len:
+                copy_viewed()
+                if not has_more():
+                    return None
+            num = min(num, stored_remaining, chunk_len - offset_byte)
+            if max_output_size is not None and num_bytes_out + num > max_output_size:
+                return None
+
+            view = memoryview(chunk)[offset_byte:offset_byte + num]
+            offset_byte += num
+            stored_remaining -= num
+            num_bytes_out += num
+            num_bytes_viewed += num
+            if not stored_remaining:
+                copy_viewed()
+
+            return view
+
+        def next_block():
+            # Moves on from the end of a block and reads the header of the next, as _decode does,
+            # but without uncompressing anything, so a stored block can be viewed from its start.
+            # Not when splitting at flushes, since a flush is only signalled by _decode
+            nonlocal state
+
+            if state == 1 and not stored_remaining:
+                copy_stored(window_pos, window_pos)
+                state = 0
+            if state != 0 or b_final or split_at_flush:
+                return
+            copy_viewed()
+            if block_start_hook is not None:
+                block_start_hook(
+                    compressed_bit_offset(),
+                    num_bytes_out,
+                    memoryview(window)[window_pos - cache_size if window_pos > cache_size else 0:window_pos],
+                )
+            read_block_header()
+
+        def copy_viewed():
+            nonlocal window_pos, num_bytes_viewed
+
+            if num_bytes_viewed:
+                num_to_keep = num_bytes_viewed if num_bytes_viewed < cache_size else cache_size
+                make_space(num_to_keep)
+                window[window_pos:window_pos + num_to_keep] = memoryview(chunk)[offset_byte - num_to_keep:offset_byte]
+                window_pos += num_to_keep
+                num_bytes_viewed = 0
+
+        def compressed_bit_offset():
+            return (num_bytes_before_chunk + offset_byte) * 8 - bit_cnt + skip_bits
+
+        def _checkpoint():
+            copy_viewed()
+            return (
+                compressed_bit_offset(), num_bytes_out,
+                bytes(window[window_pos - cache_size if window_pos > cache_size else 0:window_pos]),
+                state, b_final, stored_remaining,
+                literal_stop_or_length_code_lengths, backwards_dist_code_lengths,
+                match_remaining, match_dist,
+            )
+
+        def _resume(
+            _compressed_bit_offset, uncompressed_offset, history, _state=0, _b_final=0, _stored_remaining=0,
+            _literal_stop_or_length_code_lengths=(), _backwards_dist_code_lengths=(), _match_remaining=0, _match_dist=0,
+        ):
+            # The compressed input must start at the byte that contains _compressed_bit_offset
+            nonlocal num_bytes_before_chunk, num_bytes_out, skip_bits, window_pos
+            nonlocal state, b_final, stored_remaining, match_remaining, match_dist
+            nonlocal literal_stop_or_length_codes, backwards_dist_codes, literal_stop_or_length_code_lengths, backwards_dist_code_lengths
+
+            num_bytes_before_chunk = _compressed_bit_offset // 8
+            skip_bits = _compressed_bit_offset % 8
+            num_bytes_out = uncompressed_offset
+            window[0:len(history)] = history
+            window_pos = len(history)
+
+            state, b_final, stored_remaining, match_remaining, match_dist = _state, _b_final, _stored_remaining, _match_remaining, _match_dist
+            literal_stop_or_length_code_lengths = _literal_stop_or_length_code_lengths
+            backwards_dist_code_lengths = _backwards_dist_code_lengths
+            if state == 2:
+                try:
+                    literal_stop_or_length_codes = _get_huffman_codes(literal_stop_or_length_code_lengths, 9, num_literal_stop_or_length_values)
+                    backwards_dist_codes = _get_huffman_codes(backwards_dist_code_lengths, 6, num_dist_values)
+                except ValueError:
+                    raise InvalidCheckpoint('Checkpoint has no Huffman codes') from None
+
+        # Back to the start of a new stream, keeping the window, which doesn't need to be zeroed
+        # since nothing before window_pos is ever read
+        def _reset():
+            nonlocal chunk, chunk_len, offset_byte, bit_buf, bit_cnt, at_flush, num_bytes_viewed, num_bytes_before_chunk, num_bytes_out, skip_bits, window_pos
+            nonlocal state, b_final, stored_remaining, match_remaining, match_dist
+            nonlocal literal_stop_or_length_codes, backwards_dist_codes, literal_stop_or_length_code_lengths, backwards_dist_code_lengths
+            nonlocal block_num_matches, block_num_match_bytes, block_header_seconds, block_decode_seconds
+
+            chunk, chunk_len, offset_byte, bit_buf, bit_cnt, at_flush, num_bytes_viewed = b'', 0, 0, 0, 0, False, 0
+            num_bytes_before_chunk, num_bytes_out, skip_bits, window_pos = 0, 0, 0, 0
+            state, b_final, stored_remaining, match_remaining, match_dist = 0, 0, 0, 0, 0
+            literal_stop_or_length_codes, backwards_dist_codes = None, None
+            literal_stop_or_length_code_lengths, backwards_dist_code_lengths = (), ()
+            block_num_matches, block_num_match_bytes, block_header_seconds, block_decode_seconds = 0, 0, 0.0, 0.0
 
-            while num_bits:
-                bit = (reader_get_bit() if reader_has_bit() else (yield get_bit))
-                out[out_offset_bit // 8] |= bit << (out_offset_bit % 8)
+        def _is_done():
+            return state == 3
 
-                num_bits -= 1
-                out_offset_bit += 1
+        def _at_flush():
+            return at_flush
 
-            return bytes(out)
+        def _num_bytes_unconsumed():
+            return chunk_len - offset_byte + bit_cnt // 8
+
+        return _decode, _stored_view, _checkpoint, _resume, _reset, _is_done, _at_flush, _num_bytes_unconsumed
+
+    # The same interface as get_decoder, but using zlib, so only for Deflate and not Deflate64,
+    # and without checkpoints, since zlib's state can't be saved or restored: there's no checkpoint
+    # or resume function. Input is passed to zlib a chunk at a time, and zlib's own limit on the
+    # output of each call is used to return no more than requested
+    def get_zlib_decoder(it_next):
+        decompressobj = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+        chunk = b''
+        may_have_output = False
+
+        # Only needed to check against any limits
+        num_bytes_in = 0
+        num_bytes_out = 0
+
+        def _decode(num):
+            nonlocal chunk, may_have_output, num_bytes_in, num_bytes_out
+
+            pages = []
+            num_out = 0
+            if max_output_size is not None and max_output_size + 1 - num_bytes_out < num:
+                num = max_output_size + 1 - num_bytes_out
+
+            while num_out != num and not decompressobj.eof:
+                # zlib can hold back output even when it's consumed all the input it's been given,
+                # which is only possible if the last call returned as much as was asked for
+                if not chunk and not may_have_output:
+                    try:
+                        chunk = it_next()
+                    except StopIteration:
+                        break
+                    num_bytes_in += len(chunk)
 
-        def get_bytes(num_bytes):
-            out: bytearray = bytearray(num_bytes)
-            out_offset = 0
+                try:
+                    page = decompressobj.decompress(chunk, num - num_out)
+                except zlib.error as e:
+                    raise StreamInflateError(str(e)) from e
 
-            while out_offset != num_bytes:
-                out[out_offset] = (reader_get_byte() if reader_has_byte() else (yield get_byte))
-                out_offset += 1
+                may_have_output = len(page) == num - num_out
+                chunk = decompressobj.unconsumed_tail
+                pages.append(page)
+                num_out += len(page)
 
-            return bytes(out)
+            if limited:
+                num_bytes_out += num_out
+                check_limits(num_bytes_out, num_bytes_in - _num_bytes_unconsumed())
+            return pages[0] if len(pages) == 1 else b''.join(pages)
 
-        return get_bit, get_bits, get_bits_as_bytes, get_bytes
+        def _stored_view(_):
+            return None
 
-    def paginate(get_bytes_iter, page_size):
+        def _reset():
+            nonlocal decompressobj, chunk, may_have_output, num_bytes_in, num_bytes_out
 
-        def _paginate(bytes_iter):
+            decompressobj = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
             chunk = b''
-            offset = 0
-            it = iter(bytes_iter)
-
-            def up_to_page_size(num):
-                nonlocal chunk, offset
-
-                while num:
-                    if offset == len(chunk):
-                        try:
-                            chunk = next(it)
-                        except StopIteration:
-                            break
-                        else:
-                            offset = 0
-                    to_yield = min(num, len(chunk) - offset)
-                    offset = offset + to_yield
-                    num -= to_yield
-                    yield chunk[offset - to_yield:offset]
-
-            while True:
-                page = b''.join(up_to_page_size(page_size))
-                if not page:
-                    break
-                yield page
+            may_have_output = False
+            num_bytes_in = 0
+            num_bytes_out = 0
 
-        def _run(*args, **kwargs):
-            yield from _paginate(get_bytes_iter(*args, **kwargs))
+        def _is_done():
+            return decompressobj.eof
 
-        return _run
+        def _at_flush():
+            return False
 
-    def inflate(get_bit, get_bits, get_bits_as_bytes, get_bytes, reader_yield_bytes_up_to):
+        def _num_bytes_unconsumed():
+            return len(decompressobj.unused_data) if decompressobj.eof else len(chunk)
 
-        def via_cache(bytes_iter):
-            nonlocal cache_end, cache_len
+        return _decode, _stored_view, None, None, _reset, _is_done, _at_flush, _num_bytes_unconsumed
 
-            for chunk in bytes_iter:
-                chunk_len = _len(chunk)
-                cacheable_chunk_len = chunk_len if chunk_len < cache_size else cache_size
-                chunk_start = chunk_len - cacheable_chunk_len
-                part_1_len = (cache_size - cache_end) if (cache_size - cache_end) < cacheable_chunk_len else cacheable_chunk_len
-                part_2_len = cacheable_chunk_len - part_1_len
+    def get_discarder(append, decoder_decode, decoder_stored_view, decoder_is_done):
 
-                cache[cache_end:cache_end + part_1_len] = chunk[chunk_start:chunk_start + part_1_len]
-                cache_end = (cache_end + part_1_len) % cache_size
+        # Uncompresses up to num bytes, or to the end of the stream if num is None, but only into the
+        # decoder's window. Of the bytes of a stored block, only the last cache_size before the
+        # window is next needed are copied into it, since only they can be used by back-references
+        def _discard(new_iterable, num):
+            nonlocal is_done
 
-                if part_2_len:
-                    cache[cache_end:cache_end + part_2_len] = chunk[chunk_start + part_1_len:chunk_start + part_1_len + part_2_len]
-                    cache_end = (cache_end + part_2_len) % cache_size
+            append(new_iterable)
+            num_bytes = 0
+
+            while num_bytes != num:
+                page_size = chunk_size if num is None else min(num - num_bytes, chunk_size)
+                page = decoder_stored_view(page_size)
+                if page is None:
+                    page = decoder_decode(page_size)
+                    if not page:
+                        break
+                num_bytes += len(page)
 
-                cache_len = (cache_len + cacheable_chunk_len) if (cache_len + cacheable_chunk_len) < cache_size else cache_size
+            is_done = decoder_is_done()
+            return num_bytes
 
-                yield chunk
+        return _discard
 
-        def from_cache(dist, length):
-            if dist > cache_len:
-                raise BackwardsTooFar('Looking backwards {} bytes but only {} bytes in stream so far'.format(dist, cache_len))
+    def get_paginator(append, decoder_decode, decoder_stored_view, decoder_is_done, decoder_at_flush, discard):
 
-            min_length_dist = dist if dist < length else length
-            part_1_start = (cache_end - dist) % cache_size
-            part_1_end = (part_1_start + min_length_dist) if (part_1_start + min_length_dist) < cache_size else cache_size
-            part_2_start = 0
-            part_2_end = min_length_dist - (part_1_end - part_1_start)
+        def _run(new_iterable):
+            nonlocal is_done, num_to_skip
 
-            parts = cache[part_1_start:part_1_end] + cache[part_2_start:part_2_end]
-            len_parts = _len(parts)
+            append(new_iterable)
 
-            num_repeats = length // len_parts
-            extra = length - num_repeats * len_parts
+            if num_to_skip:
+                num_to_skip -= discard((), num_to_skip)
+                if num_to_skip:
+                    return
 
-            yield parts * num_repeats + parts[:extra]
+            while True:
+                # Pages of stored blocks are yielded as memoryviews of the input chunk: no copies.
+                # They end early at the end of the block or the input chunk. Not when splitting at
+                # flushes, since then it wouldn't be known if a page ends at a flush
+                view = decoder_stored_view(chunk_size) if not split_at_flush else None
+                if view is not None:
+                    yield view
+                    continue
+
+                page = decoder_decode(chunk_size)
+
+                if split_at_flush:
+                    yield from split_at_flushes(page)
+                    if decoder_at_flush() or len(page) == chunk_size:
+                        continue
+                elif len(page) == chunk_size:
+                    yield bytes(page)
+                    continue
+                elif page:
+                    yield bytes(page)
+
+                is_done = decoder_is_done()
+                return
+
+        # A full page could end at a flush, but that's only known on the next call to the decoder,
+        # so each is held back until then. is_at_flush is set before yielding, so it's correct as
+        # soon as the caller has the page. Every flush ends exactly one page: if there's nothing
+        # else to end, such as when the bytes before it were output by an earlier call before the
+        # flush marker was passed, or the message is empty, the page is empty
+        def split_at_flushes(page):
+            nonlocal held, is_at_flush
+
+            if held is not None:
+                is_at_flush = decoder_at_flush() and not page
+                yield held
+                held = None
+                if is_at_flush:
+                    return
 
-        def get_huffman_codes(lengths) -> dict:
+            if decoder_at_flush():
+                is_at_flush = True
+                yield bytes(page)
+            elif len(page) == chunk_size:
+                held = bytes(page)
+            elif page:
+                is_at_flush = False
+                yield bytes(page)
 
-            def yield_codes():
-                max_bits = max(lengths)
-                bl_count = defaultdict(int, Counter(lengths))
-                next_code = {}
-                code = 1
-                bl_count[0] = 0
-                for bits in range(1, max_bits + 1):
-                     code = (code + bl_count[bits - 1]) << 1;
-                     next_code[bits] = code
+        return _run
 
-                for value, length in enumerate(lengths):
-                    if length != 0:
-                        next_code[length] += 1
-                        yield next_code[length] - 1, value
+    def get_into(append, decoder_decode, decoder_is_done, discard):
 
-            return dict(yield_codes())
+        def _into(new_iterable, buffer):
+            nonlocal is_done, num_to_skip
 
-        def get_huffman_value(codes: dict):
-            code = 1
-            while True:
-                code = (code << 1) | (reader_get_bit() if reader_has_bit() else (yield get_bit))
-                value = codes.get(code)
-                if value is not None:
-                    return value
-
-        def get_code_length_code_lengths(num_length_codes):
-            result = [0] * num_length_codes
-            for i in range(0, num_length_codes):
-                result[i] = (yield from get_bits(3))
-            return tuple(result)
-
-        def get_code_lengths(code_length_codes, num_codes):
-            result: list = [0] * num_codes
-
-            i = 0
-            previous = None
-            while i < num_codes:
-                code = yield from get_huffman_value(code_length_codes)
-                if code < 16:
-                    previous = code
-                    result[i] = code
-                    i += 1
-                elif code == 16:
-                    for _ in range(0, 3 + (yield from get_bits(2))):
-                        result[i] = previous
-                        i += 1
-                elif code == 17:
-                    i += 3 + (yield from get_bits(3))
-                    previous = 0
-                elif code == 18:
-                    i += 11 + (yield from get_bits(7))
-                    previous = 0
+            append(new_iterable)
 
-            return result
+            if num_to_skip:
+                num_to_skip -= discard((), num_to_skip)
+                if num_to_skip:
+                    return 0
+            out = memoryview(buffer).cast('B')
+            out_len = len(out)
+            num_bytes = 0
+
+            while num_bytes != out_len:
+                uncompressed = decoder_decode(min(out_len - num_bytes, chunk_size))
+                if not uncompressed:
+                    break
+                out[num_bytes:num_bytes + len(uncompressed)] = uncompressed
+                num_bytes += len(uncompressed)
 
-        def yield_bytes(num_bytes):
+            is_done = decoder_is_done()
+            return num_bytes
 
-            def to_yield():
-                nonlocal num_bytes
+        return _into
 
-                for chunk in reader_yield_bytes_up_to(num_bytes):
-                    num_bytes -= len(chunk)
-                    yield chunk
+    # Only set once all the uncompressed bytes have been output to the caller
+    is_done = False
 
-            while num_bytes:
-                yield DeferredYielder(can_proceed=reader_has_byte, to_yield=via_cache(to_yield()), return_value=_none)
+    # Uncompressed bytes to discard before any are output
+    num_to_skip = skip
 
-        def yield_from_cache_without_via(num_bytes):
-            return DeferredYielder(can_proceed=_true, to_yield=from_cache(num_bytes, num_bytes), return_value=_none)
+    # If the last page output ends at a flush, and the page held back until it's known if it ends
+    # at a flush, both only used if split_at_flush is set
+    is_at_flush = False
+    held = None
 
-        def yield_from_cache(dist, length):
-            return DeferredYielder(can_proceed=_true, to_yield=via_cache(from_cache(dist, length)), return_value=_none)
+    def _is_at_flush():
+        return is_at_flush
 
-        _len = len
-        b_final = 0
+    def _is_done():
+        return is_done
 
-        # A circular cache storing the most recent cache_size bytes yielded in the stream, and
-        # bytes that haven't quite yet been yielded, but will be
-        cache: bytearray = bytearray(cache_size)
-        cache_end = 0
-        cache_len = 0
-        to_yield_in_cache = 0
+    # So the same functions, window and tables can be used for another stream
+    def _reset():
+        nonlocal is_done, is_at_flush, held, num_to_skip
 
-        while not b_final:
-            b_final = yield from get_bits(1)
-            b_type = yield from get_bits(2)
+        it_clear()
+        decoder_reset()
+        is_done = False
+        is_at_flush = False
+        held = None
+        num_to_skip = skip
+
+    it_append, it_next, it_clear = get_iterable_queue()
+    decoder_decode, decoder_stored_view, decoder_checkpoint, decoder_resume, decoder_reset, decoder_is_done, decoder_at_flush, decoder_num_bytes_unconsumed = (get_zlib_decoder if use_zlib else get_decoder)(it_next)
+    if resume_from is not None:
+        decoder_resume(*resume_from)
+
+    discard = get_discarder(it_append, decoder_decode, decoder_stored_view, decoder_is_done)
+    return _Inflater(
+        uncompressed_chunks=get_paginator(it_append, decoder_decode, decoder_stored_view, decoder_is_done, decoder_at_flush, discard),
+        uncompressed_into=get_into(it_append, decoder_decode, decoder_is_done, discard),
+        discard=discard,
+        is_done=_is_done,
+        is_at_flush=_is_at_flush,
+        num_bytes_unconsumed=decoder_num_bytes_unconsumed,
+        checkpoint=decoder_checkpoint,
+        reset=_reset,
+    )
 
-            if b_type == 3:
-                raise UnsupportedBlockType(b_type)
 
-            if b_type == 0:
-                b_len = int.from_bytes((yield from get_bytes(2)), byteorder='little')
-                yield from get_bytes(2)
-                yield from yield_bytes(b_len)
+# Decodes symbols of a Huffman block while there are at least 16 bytes of the current input chunk
+# left, which is enough for any symbol, so unlike copy_huffman_slow it never has to undo consuming
+# part of a symbol, and can keep the bits in a 64-bit integer, refilling in the middle of a
+# symbol if needed. Typed so when compiled with Cython it's all C, and runs without the GIL so
+# other threads can run, but it also runs as plain Python
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _copy_huffman_fast(
+    window: cython.uchar[:], out_pos: cython.Py_ssize_t, out_end: cython.Py_ssize_t,
+    chunk: cython.const[cython.uchar][:], offset_byte: cython.Py_ssize_t, bit_buf: cython.ulonglong, bit_cnt: cython.int,
+    literal_stop_or_length_table: cython.const[cython.uint][:], literal_stop_or_length_root_bits: cython.int,
+    backwards_dist_table: cython.const[cython.uint][:], backwards_dist_root_bits: cython.int,
+    length_extra_bits: cython.const[cython.uchar][:], length_diffs: cython.const[cython.uint][:],
+    dist_extra_bits: cython.const[cython.uchar][:], dist_diffs: cython.const[cython.uint][:],
+):
+    chunk_len: cython.Py_ssize_t = len(chunk)
+    literal_stop_or_length_mask: cython.ulonglong = (1 << literal_stop_or_length_root_bits) - 1
+    backwards_dist_mask: cython.ulonglong = (1 << backwards_dist_root_bits) - 1
+    entry: cython.uint
+    num_bits: cython.int
+    extra_bits: cython.int
+    literal_stop_or_length_code: cython.uint
+    length: cython.Py_ssize_t
+    dist: cython.Py_ssize_t = 0
+    i: cython.Py_ssize_t
+    end_of_block: cython.bint = False
+    invalid_huffman_code: cython.bint = False
+    backwards_too_far: cython.bint = False
+    match_remaining: cython.Py_ssize_t = 0
+    match_dist: cython.Py_ssize_t = 0
+    num_matches: cython.Py_ssize_t = 0
+    num_match_bytes: cython.Py_ssize_t = 0
+
+    # Errors can only be raised with the GIL, so they stop the loop and are raised after it
+    with cython.nogil:
+        while out_pos != out_end and offset_byte + 16 <= chunk_len:
+            while bit_cnt <= 56:
+                bit_buf |= cython.cast(cython.ulonglong, chunk[offset_byte]) << bit_cnt
+                offset_byte += 1
+                bit_cnt += 8
+
+            entry = literal_stop_or_length_table[bit_buf & literal_stop_or_length_mask]
+            if entry & 16:
+                entry = literal_stop_or_length_table[(entry >> 5) + ((bit_buf >> literal_stop_or_length_root_bits) & ((1 << (entry & 15)) - 1))]
+            num_bits = entry & 15
+            if not num_bits:
+                invalid_huffman_code = True
+                break
+            bit_buf >>= num_bits
+            bit_cnt -= num_bits
+
+            literal_stop_or_length_code = entry >> 5
+            if literal_stop_or_length_code < 256:
+                window[out_pos] = literal_stop_or_length_code
+                out_pos += 1
                 continue
 
-            if b_type == 1:
-                literal_stop_or_length_codes = get_huffman_codes(literal_stop_or_length_code_lengths)
-                backwards_dist_codes = get_huffman_codes(dist_code_lengths)
-            else:
-                num_literal_length_codes = (yield from get_bits(5)) + 257
-                num_dist_codes = (yield from get_bits(5)) + 1
-                num_length_codes = (yield from get_bits(4)) + 4
-
-                code_length_code_lengths = (yield from get_code_length_code_lengths(num_length_codes)) + ((0,) * (19 - num_length_codes))
-                code_length_code_lengths = tuple(
-                    v for i, v in
-                    sorted(enumerate(code_length_code_lengths), key=lambda x: code_lengths_alphabet[x[0]])
-                )
-                code_length_codes = get_huffman_codes(code_length_code_lengths)
+            if literal_stop_or_length_code == 256:
+                end_of_block = True
+                break
+
+            # Up to 31 bits can be consumed for the length, since Deflate64's length code 285 has 16
+            # extra bits after a code of up to 15, which can leave fewer than the 29 that may be
+            # needed for the distance, so the buffer is refilled before it
+            extra_bits = length_extra_bits[literal_stop_or_length_code - 257]
+            length = length_diffs[literal_stop_or_length_code - 257] + (bit_buf & ((1 << extra_bits) - 1))
+            bit_buf >>= extra_bits
+            bit_cnt -= extra_bits
+            while bit_cnt <= 56:
+                bit_buf |= cython.cast(cython.ulonglong, chunk[offset_byte]) << bit_cnt
+                offset_byte += 1
+                bit_cnt += 8
+
+            entry = backwards_dist_table[bit_buf & backwards_dist_mask]
+            if entry & 16:
+                entry = backwards_dist_table[(entry >> 5) + ((bit_buf >> backwards_dist_root_bits) & ((1 << (entry & 15)) - 1))]
+            num_bits = entry & 15
+            if not num_bits:
+                invalid_huffman_code = True
+                break
+            bit_buf >>= num_bits
+            bit_cnt -= num_bits
+            extra_bits = dist_extra_bits[entry >> 5]
+            dist = dist_diffs[entry >> 5] + (bit_buf & ((1 << extra_bits) - 1))
+            bit_buf >>= extra_bits
+            bit_cnt -= extra_bits
+
+            if dist > out_pos:
+                backwards_too_far = True
+                break
+
+            num_matches += 1
+            num_match_bytes += length
+            if length > out_end - out_pos:
+                match_remaining = length - (out_end - out_pos)
+                match_dist = dist
+                length = out_end - out_pos
+
+            # Byte by byte, so overlapping back-references repeat as they should
+            for i in range(0, length):
+                window[out_pos + i] = window[out_pos - dist + i]
+            out_pos += length
+
+    if invalid_huffman_code:
+        raise InvalidHuffmanCode('Sequence of bits {:015b} is not a Huffman code'.format(bit_buf & 0x7FFF))
+
+    if backwards_too_far:
+        raise BackwardsTooFar('Looking backwards {} bytes but only {} bytes in stream so far'.format(dist, out_pos))
+
+    return out_pos, offset_byte, bit_buf, bit_cnt, end_of_block, match_remaining, match_dist, num_matches, num_match_bytes
+
+
+# If this module has been compiled with Cython, which is only known from inside it
+_compiled = cython.compiled
+
+# Only when compiled is _copy_huffman_fast faster than copy_huffman_slow
+_fast_huffman = _compiled
+
+
+@lru_cache(maxsize=128)
+def _get_huffman_codes(lengths, root_bits, num_values):
+    # A zlib-style lookup table: the primary part is indexed by the next root_bits bits
+    # of the stream, and codes longer than that are resolved by sub-tables appended to
+    # the end of it. Each entry is either (value << 5) | length for a code of the given
+    # length, 16 | (sub_table_start << 5) | sub_table_bits for a link to a sub-table, or
+    # 0 for a sequence of bits that isn't a code. Codes for values of num_values or more,
+    # such as length codes 286 and 287, take part in assigning the codes of other values,
+    # but are left as 0 so they're never decoded and never index past the extra bits tables
+
+    max_bits = max(lengths)
+    root_bits = min(root_bits, max_bits)
+    bl_count = defaultdict(int, Counter(lengths))
+    next_code = {}
+    code = 0
+    bl_count[0] = 0
+    for bits in range(1, max_bits + 1):
+        code = (code + bl_count[bits - 1]) << 1
+        next_code[bits] = code
+        # If there are more codes of this length than the shorter codes leave room for, then the
+        # lengths are over-subscribed: the codes would overlap or be longer than their lengths
+        if next_code[bits] + bl_count[bits] > 1 << bits:
+            raise InvalidHuffmanCode('Code lengths are over-subscribed: more than {} codes of length {}'.format((1 << bits) - next_code[bits], bits))
+
+    # Deflate packs Huffman codes starting from their most significant bit, so they
+    # need to be reversed to index a table that's indexed by bits least significant first
+    def reverse(code, length):
+        reversed_code = 0
+        for _ in range(0, length):
+            reversed_code = (reversed_code << 1) | (code & 1)
+            code >>= 1
+        return reversed_code
+
+    codes = []
+    for value, length in enumerate(lengths):
+        if length != 0:
+            codes.append((reverse(next_code[length], length), length, value))
+            next_code[length] += 1
+
+    root_mask = (1 << root_bits) - 1
+    sub_table_bits = defaultdict(int)
+    for code, length, _ in codes:
+        if length > root_bits:
+            sub_table_bits[code & root_mask] = max(sub_table_bits[code & root_mask], length - root_bits)
+
+    table = [0] * (1 << root_bits)
+    for root_code, bits in sorted(sub_table_bits.items()):
+        table[root_code] = 16 | (len(table) << 5) | bits
+        table.extend([0] * (1 << bits))
+
+    for code, length, value in codes:
+        if value >= num_values:
+            continue
+        if length <= root_bits:
+            start, stride, num = code, 1 << length, 1 << (root_bits - length)
+        else:
+            link = table[code & root_mask]
+            start, stride, num = (link >> 5) + (code >> root_bits), 1 << (length - root_bits), 1 << ((link & 15) - (length - root_bits))
+        for i in range(start, start + stride * num, stride):
+            table[i] = (value << 5) | length
+
+    # The array is for _copy_huffman_fast when compiled, where it's accessed as a C array
+    return tuple(table), root_bits, array('I', table)
+
+
+# A read-only file-like object of the uncompressed bytes, where compressed is either an iterable
+# of bytes, or a file-like object that has a read method. Reads go straight into the caller's
+# buffer, and the compressed iterable is only passed the first time: after that it's in the
+# decompressor's own queue
+class _StreamInflateFile(io.RawIOBase):
+
+    def __init__(self, inflater, compressed):
+        super().__init__()
+        self._uncompressed_into, self._is_done, self._num_bytes_unconsumed = inflater
+        self._compressed = \
+            iter(lambda: compressed.read(65536), b'') if hasattr(compressed, 'read') else \
+            compressed
+        self._offset = 0
+
+    def readable(self):
+        return True
 
-                dynamic_code_lengths = yield from get_code_lengths(code_length_codes, num_literal_length_codes + num_dist_codes)
-                dynamic_literal_code_lengths = dynamic_code_lengths[:num_literal_length_codes]
-                dynamic_dist_code_lengths = dynamic_code_lengths[num_literal_length_codes:]
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        num_bytes = self._uncompressed_into(self._compressed, buffer)
+        self._compressed = ()
+        if not num_bytes and memoryview(buffer).nbytes and not self._is_done():
+            raise TruncatedStream('Compressed input ended before the end of the stream')
+
+        self._offset += num_bytes
+        return num_bytes
+
+    def tell(self):
+        return self._offset
+
+
+# Statistics of a single block passed to on_block when the block ends. Compressed positions are in
+# bits and uncompressed in bytes, both from the start of the stream, and header_seconds includes
+# building the block's Huffman tables
+BlockStats = namedtuple('BlockStats', (
+    'block_type', 'is_final',
+    'compressed_bit_start', 'compressed_bit_end',
+    'uncompressed_start', 'uncompressed_end',
+    'num_literals', 'num_matches', 'average_match_length',
+    'header_seconds', 'decode_seconds',
+))
+
+# The functions that _stream_inflate returns, which each public function picks from by name
+_Inflater = namedtuple('_Inflater', (
+    'uncompressed_chunks', 'uncompressed_into', 'discard',
+    'is_done', 'is_at_flush', 'num_bytes_unconsumed',
+    'checkpoint', 'reset',
+))
+
+ZipMember = namedtuple('ZipMember', (
+    'file_name', 'compression_method', 'flags',
+    'crc_32', 'compressed_size', 'uncompressed_size',
+))
+
+
+# The tables for fixed Huffman blocks are the same for all streams, so are built just once, with
+# the distance table by the number of distance codes, since Deflate64 has 2 more than Deflate. The
+# tables for dynamic blocks are built via an LRU cache on the code lengths, since encoders often
+# use exactly the same code lengths for many blocks, and the built tables are never mutated
+_fixed_literal_stop_or_length_code_lengths = (8,) * 144 + (9,) * 112 + (7,) * 24 + (8,) * 8
+_fixed_dist_code_lengths = (5,) * 32
+_fixed_literal_stop_or_length_codes = _get_huffman_codes(_fixed_literal_stop_or_length_code_lengths, 9, 257 + len(_deflate_length_extra_bits_diffs))
+_fixed_dist_codes = {
+    len(dist_extra_bits_diffs): _get_huffman_codes(_fixed_dist_code_lengths, 6, len(dist_extra_bits_diffs))
+    for dist_extra_bits_diffs in (_deflate_dist_extra_bits_diffs, _deflate64_dist_extra_bits_diffs)
+}
+
+
+class _NotEnoughInput(Exception):
+    pass
 
-                literal_stop_or_length_codes = get_huffman_codes(dynamic_literal_code_lengths)
-                backwards_dist_codes = get_huffman_codes(dynamic_dist_code_lengths)
 
-            while True:
-                literal_stop_or_length_code = yield from get_huffman_value(literal_stop_or_length_codes)
-                if literal_stop_or_length_code < 256:
-                    if to_yield_in_cache == cache_size:
-                        yield yield_from_cache_without_via(to_yield_in_cache)
-                        to_yield_in_cache = 0
-
-                    cache[cache_end] = literal_stop_or_length_code
-                    cache_end = (cache_end + 1) % cache_size
-                    cache_len = (cache_len + 1) if (cache_len + 1) < cache_size else cache_size
-                    to_yield_in_cache += 1
-                elif literal_stop_or_length_code == 256:
-                    break
-                else:
-                    length_extra_bits, length_diff = length_extra_bits_diffs[literal_stop_or_length_code - 257]
-                    length_extra = int.from_bytes((yield from get_bits_as_bytes(length_extra_bits)), byteorder='little')
+class StreamInflateError(ValueError):
+    pass
 
-                    code = yield from get_huffman_value(backwards_dist_codes)
-                    dist_extra_bits, dist_diff = dist_extra_bits_diffs[code]
-                    dist_extra = int.from_bytes((yield from get_bits_as_bytes(dist_extra_bits)), byteorder='little')
 
-                    if to_yield_in_cache:
-                        yield yield_from_cache_without_via(to_yield_in_cache)
-                        to_yield_in_cache = 0
-                    yield yield_from_cache(dist=dist_extra + dist_diff, length=length_extra + length_diff)
+class UnsupportedBlockType(StreamInflateError):
+    pass
 
-        if to_yield_in_cache:
-            yield yield_from_cache_without_via(to_yield_in_cache)
-            to_yield_in_cache = 0
 
-    def get_runner(append, inflater):
-        is_done = False
-        curr_deferred = None
-        prev_deferred = None
+class BackwardsTooFar(StreamInflateError):
+    pass
 
-        def _is_done():
-            return is_done
 
-        def _run(new_iterable):
-            nonlocal is_done, curr_deferred, prev_deferred
+class InvalidHuffmanCode(StreamInflateError):
+    pass
 
-            append(new_iterable)
 
-            while True:
-                if curr_deferred is None:
-                    try:
-                        curr_deferred = \
-                            next(inflater) if prev_deferred is None else \
-                            inflater.send(prev_deferred.return_value())
-                    except StopIteration:
-                        break
-                if not curr_deferred.can_proceed():
-                    return
+class InvalidIndex(StreamInflateError):
+    pass
 
-                if curr_deferred.to_yield:
-                    yield from curr_deferred.to_yield
 
-                prev_deferred = curr_deferred
-                curr_deferred = None
+class InvalidCheckpoint(StreamInflateError):
+    pass
 
-            is_done = True
 
-        return _run, _is_done
+class TruncatedStream(StreamInflateError):
+    pass
 
-    it_append, it_next = get_iterable_queue()
-    reader_has_bit, reader_has_byte, reader_get_bit, reader_get_byte, reader_yield_bytes_up_to, reader_num_bytes_unconsumed = get_readers(it_next)
-    get_bit, get_bits, get_bits_as_bytes, get_bytes = get_deferred_yielder_readers(reader_has_bit, reader_has_byte, reader_get_bit, reader_get_byte, reader_yield_bytes_up_to)
-    inflater = inflate(get_bit, get_bits, get_bits_as_bytes, get_bytes, reader_yield_bytes_up_to)
-    run, is_done = get_runner(it_append, inflater)
 
-    return paginate(run, chunk_size), is_done, reader_num_bytes_unconsumed
+class UnsupportedZipMember(StreamInflateError):
+    pass
 
 
-class StreamInflateError(ValueError):
+class InvalidHeader(StreamInflateError):
     pass
 
 
-class UnsupportedBlockType(StreamInflateError):
+class InvalidChecksum(StreamInflateError):
     pass
 
 
-class BackwardsTooFar(StreamInflateError):
+class OutputLimitExceeded(StreamInflateError):
     pass
+
@@ -0,0 +1,102 @@
+import argparse
+import contextlib
+import os
+import sys
+from time import perf_counter
+
+import stream_inflate
+from stream_inflate import StreamInflateError, TruncatedStream
+
+
+# The command line interface, run by python -m stream_inflate_cli or the stream-inflate script.
+# It's a separate module from stream_inflate so it's never compiled: Python can't run a compiled
+# module with -m. Input and output are unbuffered by Python: each read and write is a single large
+# system call
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='stream-inflate', description='Uncompress a raw Deflate or Deflate64 stream')
+    parser.add_argument('input', nargs='?', default='-', help='file to read the compressed stream from, or - for standard input')
+    parser.add_argument('-o', '--output', default='-', help='file to write the uncompressed data to, or - for standard output')
+    parser.add_argument('--deflate64', action='store_true', help='uncompress Deflate64 rather than Deflate')
+    parser.add_argument('--use-zlib', action='store_true', help='uncompress Deflate with zlib')
+    parser.add_argument('--offset', type=int, default=0, help='number of bytes of the input to skip before the compressed stream')
+    parser.add_argument('--read-size', type=int, default=1048576, help='number of bytes of the input to read at a time')
+    parser.add_argument('--chunk-size', type=int, default=1048576, help='number of uncompressed bytes to write at a time')
+    parser.add_argument('--stats', action='store_true', help='print throughput, compression ratio and the number of bytes after the stream, or if the input is not seekable, of those read, to standard error')
+    args = parser.parse_args(argv)
+
+    if args.deflate64 and args.use_zlib:
+        parser.error('--use-zlib is not supported with --deflate64')
+
+    with contextlib.ExitStack() as stack:
+        f_in = stack.enter_context(
+            open(sys.stdin.fileno(), 'rb', buffering=0, closefd=False) if args.input == '-' else
+            open(args.input, 'rb', buffering=0)
+        )
+        f_out = stack.enter_context(
+            open(sys.stdout.fileno(), 'wb', buffering=0, closefd=False) if args.output == '-' else
+            open(args.output, 'wb', buffering=0)
+        )
+
+        num_bytes_in = 0
+
+        def compressed_chunks():
+            nonlocal num_bytes_in
+
+            for compressed_chunk in iter(lambda: f_in.read(args.read_size), b''):
+                num_bytes_in += len(compressed_chunk)
+                yield compressed_chunk
+
+        def skip(num):
+            # Raw reads, such as from a pipe, can read fewer bytes than requested
+            while num:
+                num_bytes = len(f_in.read(min(num, args.read_size)))
+                if not num_bytes:
+                    raise TruncatedStream('Input ended {} bytes before the offset'.format(num))
+                num -= num_bytes
+
+        def write(view):
+            # Raw writes, such as to a pipe, can write fewer bytes than requested
+            while view:
+                view = view[f_out.write(view):]
+
+        try:
+            if f_in.seekable():
+                f_in.seek(args.offset)
+            else:
+                skip(args.offset)
+
+            uncompressed_chunks, is_done, num_bytes_unconsumed = \
+                stream_inflate.stream_inflate64(chunk_size=args.chunk_size) if args.deflate64 else \
+                stream_inflate.stream_inflate(chunk_size=args.chunk_size, use_zlib=args.use_zlib)
+
+            start = perf_counter()
+            num_bytes_out = 0
+            for uncompressed_chunk in uncompressed_chunks(compressed_chunks()):
+                write(memoryview(uncompressed_chunk))
+                num_bytes_out += len(uncompressed_chunk)
+            seconds = perf_counter() - start
+
+            if not is_done():
+                raise TruncatedStream('Compressed input ended before the end of the stream')
+        except (OSError, StreamInflateError) as e:
+            print('stream-inflate: {}: {}'.format(type(e).__name__, e), file=sys.stderr)
+            return 1
+
+        if args.stats:
+            # The bytes after the stream include any not yet read. These are found from the size of
+            # a seekable input rather than by reading them, which for a large file such as a ZIP
+            # could take much longer than the stream itself. Otherwise only those read are known
+            seekable = f_in.seekable()
+            num_bytes_trailing = num_bytes_unconsumed() + (os.fstat(f_in.fileno()).st_size - f_in.tell() if seekable else 0)
+            num_bytes_compressed = num_bytes_in - num_bytes_unconsumed()
+            print('{} bytes from {} bytes in {:.3f} s, {:.2f} MB/s, compression ratio {:.2f}, {}{} bytes after the stream, {}'.format(
+                num_bytes_out, num_bytes_compressed, seconds, num_bytes_out / seconds / 1e6 if seconds else 0.0,
+                num_bytes_out / num_bytes_compressed if num_bytes_compressed else 0.0,
+                '' if seekable else 'at least ', num_bytes_trailing, 'compiled' if stream_inflate._compiled else 'pure Python',
+            ), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
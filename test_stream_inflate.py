@@ -1,11 +1,85 @@
+import asyncio
+import contextlib
+import gzip
+import io
 import random
+import re
 import itertools
+import mmap
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
 import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from struct import Struct
 
 import pytest
 
-from stream_inflate import BackwardsTooFar, UnsupportedBlockType, stream_inflate, stream_inflate64
+import stream_inflate as stream_inflate_module
+import stream_inflate_cli
+from stream_inflate import BackwardsTooFar, BlockStats, InvalidCheckpoint, InvalidChecksum, InvalidHeader, InvalidHuffmanCode, InvalidIndex, OutputLimitExceeded, StreamInflateError, TruncatedStream, UnsupportedBlockType, UnsupportedZipMember, ZipMember, stream_inflate, stream_inflate64, stream_inflate_into, stream_inflate64_into, stream_inflate_file, stream_inflate64_file, stream_inflate_async, stream_inflate64_async, stream_inflate_index, stream_inflate64_index, stream_inflate_seek, stream_inflate_resumable, stream_inflate64_resumable, stream_inflate_parallel, stream_inflate_reusable, stream_inflate64_reusable, stream_inflate_zip, stream_inflate_buffer, stream_inflate64_buffer, stream_inflate_size, stream_inflate64_size, stream_inflate_zlib, stream_inflate_gzip, stream_inflate_flushing, stream_inflate64_flushing
+
+
+# Repeats of the same 100 random bytes, which compress well, followed by num_random_bytes random
+# bytes, which don't
+def _data(num_repeats, num_random_bytes=0):
+    rnd = random.Random()
+    rnd.seed(1)
+    data = rnd.getrandbits(800).to_bytes(100, byteorder='big') * num_repeats
+    if num_random_bytes:
+        data += rnd.getrandbits(num_random_bytes * 8).to_bytes(num_random_bytes, byteorder='big')
+    return data
+
+
+# A function that splits bytes into chunks of input_size, and a function that returns the total
+# size of all the chunks taken from it so far, to check num_bytes_unconsumed against
+def _content(input_size):
+    total_attempted_consumed = 0
+
+    def content(stream):
+        nonlocal total_attempted_consumed
+
+        for i in range(0, len(stream), input_size):
+            chunk = stream[i:i + input_size]
+            total_attempted_consumed += len(chunk)
+            yield chunk
+
+    return content, lambda: total_attempted_consumed
+
+
+# Writes bits into a zeroed bytearray least significant first, as Deflate packs them. Huffman codes
+# are packed starting from their most significant bit, so have to be passed to write_num reversed
+def _bit_writer(size):
+    out = bytearray(size)
+    offset = 0
+    bit_offset = 0
+
+    def write_bit(bit):
+        nonlocal bit_offset, offset
+        if bit_offset == 8:
+            offset += 1
+            bit_offset = 0
+        out[offset] |= (bit << bit_offset)
+        bit_offset += 1
+
+    def write_num(num, length):
+        # Probably not the most efficient thing in the world
+        bit_string = "{0:b}".format(num)
+        bit_string = "0" * (length - len(bit_string)) + bit_string
+        for bit in reversed(bit_string):
+            write_bit(int(bit))
+
+    return out, write_bit, write_num
+
+
+# The Deflate64 fixture, which is a ZIP file without its local header, and its uncompressed bytes
+def _deflate64_fixture():
+    with open('fixtures/deflate64.bin', 'rb') as f:
+        stream = f.read()
+    return stream, b''.join(stream_inflate64()[0]((stream,)))
 
 
 @pytest.mark.parametrize("strategy", [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FIXED])
@@ -55,27 +129,1021 @@ def test_stream_inflate(strategy, level, base_data_len, num_repeats, input_size,
     for _ in iters: pass
 
 
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("level", [0, 9])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+@pytest.mark.parametrize("buffer_size", [1, 7, 65536])
+def test_stream_inflate_into(use_zlib, level, input_size, buffer_size):
+    data = _data(1000, 10000)
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+    content, total_attempted_consumed = _content(input_size)
+
+    uncompressed_into, is_done, num_bytes_unconsumed = stream_inflate_into(use_zlib=use_zlib)
+    buffer = bytearray(buffer_size)
+    uncompressed = bytearray()
+    it = content(stream)
+    while not is_done():
+        num_bytes = uncompressed_into((next(it),), buffer)
+        uncompressed += buffer[:num_bytes]
+        while num_bytes == buffer_size:
+            num_bytes = uncompressed_into((), memoryview(buffer))
+            uncompressed += buffer[:num_bytes]
+
+    assert uncompressed == data
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == b'Unconsumed'
+
+
+@pytest.mark.parametrize("as_file", [False, True])
+@pytest.mark.parametrize("read_size", [1, 7, 65536, -1])
+def test_stream_inflate_file(as_file, read_size):
+    data = _data(1000, 10000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+
+    compressed = io.BytesIO(stream) if as_file else (stream[i:i + 7] for i in range(0, len(stream), 7))
+
+    with stream_inflate_file(compressed) as f:
+        assert f.readable()
+        assert not f.seekable()
+        uncompressed = b''
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                break
+            uncompressed += chunk
+            assert f.tell() == len(uncompressed)
+
+    assert uncompressed == data
+
+    with pytest.raises(ValueError):
+        f.read(1)
+
+
+def test_stream_inflate_file_copyfileobj():
+    data = _data(1000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+
+    out = io.BytesIO()
+    shutil.copyfileobj(stream_inflate_file((stream,)), out)
+    assert out.getvalue() == data
+
+
+def test_stream_inflate_file_truncated():
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(b'-' * 100000) + compressobj.flush()
+
+    with pytest.raises(TruncatedStream):
+        stream_inflate_file((stream[:len(stream) // 2],)).read()
+
+
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+@pytest.mark.parametrize("output_size", [1, 7, 65536])
+def test_stream_inflate_async(input_size, output_size):
+    data = _data(100, 10000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+    sync_content, total_attempted_consumed = _content(input_size)
+
+    async def content():
+        for chunk in sync_content(stream):
+            yield chunk
+
+    num_pages_before_other_task = None
+
+    async def other_task():
+        nonlocal num_pages_before_other_task
+        num_pages_before_other_task = len(pages)
+
+    async def uncompress():
+        uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_async(chunk_size=output_size)
+        task = asyncio.ensure_future(other_task())
+        async for page in uncompressed_chunks(content()):
+            pages.append(page)
+        await task
+        return is_done(), num_bytes_unconsumed()
+
+    pages = []
+    done, num_bytes_unconsumed = asyncio.run(uncompress())
+
+    assert done
+    assert b''.join(pages) == data
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed:] == b'Unconsumed'
+    assert num_pages_before_other_task == 1
+
+
+@pytest.mark.parametrize("level", [0, 1, 9])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+@pytest.mark.parametrize("suspend_size", [7, 65536])
+@pytest.mark.parametrize("output_size", [1, 7, 65536])
+def test_stream_inflate_use_zlib(level, input_size, suspend_size, output_size):
+    data = _data(100, 1000)
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+
+    def run(use_zlib):
+        content, total_attempted_consumed = _content(input_size)
+        uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate(chunk_size=output_size, use_zlib=use_zlib)
+        pages = []
+        for i in range(0, len(stream), suspend_size):
+            pages.append(b''.join(uncompressed_chunks(content(stream[i:i + suspend_size]))))
+            if is_done():
+                break
+        return pages, stream[total_attempted_consumed() - num_bytes_unconsumed():]
+
+    # The same bytes from the same calls, and the same bytes left over. The pages themselves can
+    # differ, since pages of stored blocks can end early at the end of the block or input chunk
+    assert run(use_zlib=True) == run(use_zlib=False)
+    assert run(use_zlib=True)[1] == b'Unconsumed'
+
+
+def test_stream_inflate_use_zlib_invalid():
+    with pytest.raises(StreamInflateError):
+        b''.join(stream_inflate(use_zlib=True)[0]((b'\xFF',)))
+
+    with pytest.raises(ValueError):
+        stream_inflate(on_block=print, use_zlib=True)
+
+    # There are no public functions that resume with zlib, but it's rejected rather than ignored
+    with pytest.raises(ValueError):
+        stream_inflate_module._stream_inflate(*stream_inflate_module._deflate_params[False], 65536, resume_from=(0, 0, b''), use_zlib=True)
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("level", [0, 9])
+@pytest.mark.parametrize("uncompressed_size_diff", [None, 0, -1, 1, -100000])
+@pytest.mark.parametrize("buffer_type", [bytes, bytearray, memoryview, lambda b: array('B', b), 'mmap'])
+def test_stream_inflate_buffer(tmp_path, use_zlib, level, uncompressed_size_diff, buffer_type):
+    data = _data(1000, 10000)
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+
+    # An mmap can't be closed if anything still refers to it, so this checks nothing does
+    @contextlib.contextmanager
+    def buffer(b):
+        if buffer_type != 'mmap':
+            yield buffer_type(b)
+            return
+        (tmp_path / 'stream.bin').write_bytes(b)
+        with \
+                open(tmp_path / 'stream.bin', 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as compressed:
+            yield compressed
+
+    # The uncompressed size is only used to allocate the buffer, so it doesn't have to be right
+    uncompressed_size = None if uncompressed_size_diff is None else max(len(data) + uncompressed_size_diff, 0)
+    with buffer(stream) as compressed:
+        uncompressed, num_bytes_unconsumed = stream_inflate_buffer(compressed, uncompressed_size, use_zlib=use_zlib)
+    assert uncompressed == data
+    assert stream[len(stream) - num_bytes_unconsumed:] == b'Unconsumed'
+
+    with pytest.raises(TruncatedStream):
+        with buffer(stream[:len(stream) // 2]) as compressed:
+            stream_inflate_buffer(compressed, uncompressed_size, use_zlib=use_zlib)
+
+
+@pytest.mark.parametrize("uncompressed_size", [None, 0, 1, 1000, 100000000])
+def test_stream_inflate_buffer_chunk_size(monkeypatch, uncompressed_size):
+    # An uncompressed size that's too small shouldn't mean tiny calls to the decoder
+    chunk_sizes = []
+    _stream_inflate = stream_inflate_module._stream_inflate
+
+    def spy(*args, **kwargs):
+        chunk_sizes.append(args[3])
+        return _stream_inflate(*args, **kwargs)
+
+    monkeypatch.setattr(stream_inflate_module, '_stream_inflate', spy)
+    data = _data(1000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    assert stream_inflate_buffer(compressobj.compress(data) + compressobj.flush(), uncompressed_size)[0] == data
+    assert 65536 <= chunk_sizes[0] <= 1048576
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("level", [0, 9])
+@pytest.mark.parametrize("skip", [0, 1, 65536, 100000, 109999, 110000, 200000])
+@pytest.mark.parametrize("input_size", [7, 65536])
+def test_stream_inflate_skip(use_zlib, level, skip, input_size):
+    data = _data(1000, 10000)
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+    content, total_attempted_consumed = _content(input_size)
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate(chunk_size=1000, use_zlib=use_zlib, skip=skip)
+    it = content(stream)
+    uncompressed = b''
+    while not is_done():
+        uncompressed += b''.join(uncompressed_chunks((next(it),)))
+
+    assert uncompressed == data[skip:]
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == b'Unconsumed'
+
+    content, total_attempted_consumed = _content(input_size)
+    uncompressed_size, compressed_size, num_bytes_unconsumed = stream_inflate_size(content(stream), use_zlib=use_zlib)
+    assert uncompressed_size == len(data)
+    assert compressed_size == len(stream) - len(b'Unconsumed')
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed:] == b'Unconsumed'
+
+    with pytest.raises(TruncatedStream):
+        stream_inflate_size((stream[:len(stream) // 2],), use_zlib=use_zlib)
+
+    with pytest.raises(ValueError):
+        stream_inflate(use_zlib=use_zlib, skip=-1)
+
+    with pytest.raises(ValueError):
+        stream_inflate_gzip(use_zlib=use_zlib, skip=-1)
+
+
+@pytest.mark.parametrize("flush", [zlib.Z_SYNC_FLUSH, zlib.Z_FULL_FLUSH])
+@pytest.mark.parametrize("level", [0, 1, 9])
+@pytest.mark.parametrize("chunk_size", [7, 1000, 65536])
+def test_stream_inflate_flushing(flush, level, chunk_size):
+    rnd = random.Random()
+    rnd.seed(1)
+    messages = [
+        rnd.choice([b'', b'a', b'abcdefgh' * rnd.randint(1, 3000), rnd.getrandbits(8000).to_bytes(1000, byteorder='big')])
+        for _ in range(0, 50)
+    ]
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    compressed_messages = [compressobj.compress(message) + compressobj.flush(flush) for message in messages]
+    stream = b''.join(compressed_messages) + compressobj.flush()
+
+    # Each message is output in full as soon as all of its compressed bytes are passed, even if
+    # they're passed a byte at a time
+    uncompressed_chunks, is_done, num_bytes_unconsumed, is_at_flush = stream_inflate_flushing(chunk_size=chunk_size)
+    for message, compressed_message in zip(messages, compressed_messages):
+        uncompressed = b''.join(uncompressed_chunks(
+            compressed_message[i:i + 1] for i in range(0, len(compressed_message))
+        ))
+        assert uncompressed == message
+        assert is_at_flush()
+        assert not is_done()
+
+    # When passed all at once, chunks end at each flush, and it's known which do, even for empty
+    # messages, which are output as an empty chunk
+    uncompressed_chunks, is_done, num_bytes_unconsumed, is_at_flush = stream_inflate_flushing(chunk_size=chunk_size)
+    uncompressed_messages = []
+    uncompressed_message = b''
+    for uncompressed_chunk in uncompressed_chunks((stream,)):
+        uncompressed_message += uncompressed_chunk
+        if is_at_flush():
+            uncompressed_messages.append(uncompressed_message)
+            uncompressed_message = b''
+    assert uncompressed_messages == messages
+    assert uncompressed_message == b''
+    assert is_done()
+
+    # When passed in chunks split anywhere, such as from a socket, every flush is still seen
+    splits = sorted(rnd.sample(range(1, len(stream)), 200))
+    uncompressed_chunks, is_done, num_bytes_unconsumed, is_at_flush = stream_inflate_flushing(chunk_size=chunk_size)
+    uncompressed_messages = []
+    uncompressed_message = b''
+    for start, end in zip([0] + splits, splits + [len(stream)]):
+        for uncompressed_chunk in uncompressed_chunks((stream[start:end],)):
+            uncompressed_message += uncompressed_chunk
+            if is_at_flush():
+                uncompressed_messages.append(uncompressed_message)
+                uncompressed_message = b''
+    assert uncompressed_messages == messages
+    assert uncompressed_message == b''
+    assert is_done()
+
+    # Without splitting at flushes, chunks are still all output once the input runs out
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate(chunk_size=chunk_size)
+    for message, compressed_message in zip(messages, compressed_messages):
+        assert b''.join(uncompressed_chunks((compressed_message,))) == message
+
+
+@pytest.mark.parametrize("flush", [zlib.Z_SYNC_FLUSH, zlib.Z_FULL_FLUSH])
+def test_stream_inflate_flushing_split_before_flush_marker(flush):
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    hello = compressobj.compress(b'hello') + compressobj.flush(flush)
+    world = compressobj.compress(b'world') + compressobj.flush(flush)
+    assert hello[-4:] == b'\x00\x00\xff\xff'
+
+    # The end of the first message is output before its flush marker is passed, so the flush is
+    # signalled by an empty chunk
+    uncompressed_chunks, is_done, num_bytes_unconsumed, is_at_flush = stream_inflate_flushing()
+    chunks_at_flush = [(bytes(chunk), is_at_flush()) for chunk in uncompressed_chunks((hello[:-4],))]
+    assert chunks_at_flush == [(b'hello', False)]
+    chunks_at_flush = [(bytes(chunk), is_at_flush()) for chunk in uncompressed_chunks((hello[-4:] + world,))]
+    assert chunks_at_flush == [(b'', True), (b'world', True)]
+
+
+def test_stream_inflate64_flushing():
+    stream, data = _deflate64_fixture()
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed, is_at_flush = stream_inflate64_flushing()
+    uncompressed = b''.join(uncompressed_chunks((stream,)))
+    assert uncompressed == data
+    assert is_done()
+    assert not is_at_flush()
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("level", [0, 1, 9])
+@pytest.mark.parametrize("input_size", [7, 65536])
+def test_stream_inflate_limits(use_zlib, level, input_size):
+    data = _data(1000)
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+
+    def uncompress(**kwargs):
+        uncompressed = b''
+        for chunk in stream_inflate(chunk_size=1000, use_zlib=use_zlib, **kwargs)[0](_content(input_size)[0](stream)):
+            uncompressed += chunk
+            assert len(uncompressed) <= kwargs.get('max_output_size', len(data))
+        return uncompressed
+
+    assert uncompress(max_output_size=len(data)) == data
+    with pytest.raises(OutputLimitExceeded):
+        uncompress(max_output_size=len(data) - 1)
+
+    # The ratio is checked as the stream is uncompressed, and the start of a stream, before the
+    # compressed bytes of the first repeat are used, can have a higher ratio than the whole stream
+    assert uncompress(max_ratio=1000) == data
+    if level:
+        with pytest.raises(OutputLimitExceeded):
+            uncompress(max_ratio=len(data) / len(stream) - 1)
+
+
+def test_stream_inflate_limits_bomb():
+    compressobj = zlib.compressobj(level=9, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(b'\x00' * 10_000_000) + compressobj.flush()
+
+    uncompressed_chunks, _, _ = stream_inflate(max_output_size=1_000_000)
+    num_bytes = 0
+    with pytest.raises(OutputLimitExceeded):
+        for chunk in uncompressed_chunks((stream,)):
+            num_bytes += len(chunk)
+    assert num_bytes <= 1_000_000
+
+    with pytest.raises(OutputLimitExceeded):
+        next(stream_inflate(max_ratio=100)[0]((stream,)))
+
+
+def test_stream_inflate64_limits():
+    stream, data = _deflate64_fixture()
+
+    assert b''.join(stream_inflate64(max_output_size=len(data))[0]((stream,))) == data
+    with pytest.raises(OutputLimitExceeded):
+        b''.join(stream_inflate64(max_output_size=len(data) - 1)[0]((stream,)))
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+def test_stream_inflate_reusable(use_zlib, input_size):
+    rnd = random.Random()
+    rnd.seed(1)
+    streams = []
+    for level, strategy in [(0, zlib.Z_DEFAULT_STRATEGY), (9, zlib.Z_FIXED), (9, zlib.Z_DEFAULT_STRATEGY)] * 2:
+        data = _data(rnd.randint(1, 100))
+        compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS, strategy=strategy)
+        streams.append((data, compressobj.compress(data) + compressobj.flush() + b'Unconsumed'))
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed, reset = stream_inflate_reusable(chunk_size=1000, use_zlib=use_zlib)
+
+    # Part of a stream, abandoned before its end
+    next(uncompressed_chunks((streams[0][1][:200],)))
+    assert not is_done()
+
+    for data, stream in streams:
+        content, total_attempted_consumed = _content(input_size)
+        reset()
+        assert not is_done()
+        assert b''.join(uncompressed_chunks(content(stream))) == data
+        assert is_done()
+        assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == b'Unconsumed'
+
+
+def test_stream_inflate64_reusable():
+    stream, data = _deflate64_fixture()
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed, reset = stream_inflate64_reusable()
+    next(uncompressed_chunks((stream,)))
+    for _ in range(0, 2):
+        reset()
+        assert b''.join(uncompressed_chunks((stream,))) == data
+        assert is_done()
+        assert stream[len(stream) - num_bytes_unconsumed():].startswith(b'PK\x01\x02')
+
+
+class _UnseekableBytesIO(io.RawIOBase):
+    # So zipfile writes data descriptors after each member
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+def test_stream_inflate_zip(seekable, use_zlib, input_size):
+    rnd = random.Random()
+    rnd.seed(1)
+    members = [
+        ('first.txt', b'abcdefgh' * 10000, zipfile.ZIP_DEFLATED, False),
+        ('empty', b'', zipfile.ZIP_DEFLATED, False),
+        ('random.bin', rnd.getrandbits(80000).to_bytes(10000, byteorder='big'), zipfile.ZIP_STORED, False),
+        ('zip64.txt', b'-' * 100000, zipfile.ZIP_DEFLATED, True),
+    ]
+    if not seekable:
+        # A stored member's size has to be known before its data
+        members = [member for member in members if member[2] != zipfile.ZIP_STORED]
+
+    file = io.BytesIO() if seekable else _UnseekableBytesIO()
+    with zipfile.ZipFile(file, 'w') as zf:
+        for name, data, compress_type, force_zip64 in members:
+            info = zipfile.ZipInfo(name)
+            info.compress_type = compress_type
+            with zf.open(info, 'w', force_zip64=force_zip64) as f:
+                f.write(data)
+    zipped = file.getvalue() if seekable else bytes(file.data)
+
+    def content():
+        for i in range(0, len(zipped), input_size):
+            yield zipped[i:i + input_size]
+
+    uncompressed = [
+        (member, b''.join(uncompressed_chunks))
+        for member, uncompressed_chunks in stream_inflate_zip(content(), use_zlib=use_zlib)
+    ]
+    assert [(member.file_name, data) for member, data in uncompressed] == \
+        [(name.encode(), data) for name, data, _, _ in members]
+    assert all(isinstance(member, ZipMember) for member, _ in uncompressed)
+    assert [member.compression_method for member, _ in uncompressed] == \
+        [compress_type for _, _, compress_type, _ in members]
+    assert [(member.crc_32, member.uncompressed_size) for member, _ in uncompressed] == \
+        [(zlib.crc32(data), len(data)) if seekable else (None, None) for _, data, _, _ in members]
+
+    # Members that aren't used are skipped
+    assert [member.file_name for member, _ in stream_inflate_zip(content())] == \
+        [name.encode() for name, _, _, _ in members]
+
+
+def test_stream_inflate_zip_invalid():
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_BZIP2) as zf:
+        zf.writestr('file.txt', b'abc')
+    with pytest.raises(UnsupportedZipMember):
+        next(stream_inflate_zip((file.getvalue(),)))
+
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('file.txt', b'abc' * 1000)
+    with pytest.raises(TruncatedStream):
+        for _, uncompressed_chunks in stream_inflate_zip((file.getvalue()[:50],)):
+            b''.join(uncompressed_chunks)
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+def test_stream_inflate_zip_limits(use_zlib):
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('bomb.bin', bytes(10000000))
+    bomb = file.getvalue()
+
+    for kwargs in ({'max_output_size': 1000000}, {'max_ratio': 100}):
+        num_bytes = 0
+        with pytest.raises(OutputLimitExceeded):
+            for _, uncompressed_chunks in stream_inflate_zip((bomb,), use_zlib=use_zlib, **kwargs):
+                for uncompressed_chunk in uncompressed_chunks:
+                    num_bytes += len(uncompressed_chunk)
+        assert num_bytes <= 1000000
+
+    # The members are each under max_output_size, but not all of them together
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, 'w') as zf:
+        zf.writestr('first.bin', bytes(600000), compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr('second.bin', bytes(600000), compress_type=zipfile.ZIP_STORED)
+    with pytest.raises(OutputLimitExceeded):
+        for _, uncompressed_chunks in stream_inflate_zip((file.getvalue(),), use_zlib=use_zlib, max_output_size=1000000):
+            b''.join(uncompressed_chunks)
+    assert [
+        len(b''.join(uncompressed_chunks))
+        for _, uncompressed_chunks in stream_inflate_zip((file.getvalue(),), use_zlib=use_zlib, max_output_size=1200000)
+    ] == [600000, 600000]
+
+
+def _gzip_member_with_all_fields(data):
+    flags = 0x02 | 0x04 | 0x08 | 0x10
+    header = b'\x1f\x8b\x08' + bytes([flags]) + b'\x00\x00\x00\x00\x00\xff' + \
+        Struct('<H').pack(5) + b'extra' + b'file.txt\x00' + b'A comment\x00'
+    header += Struct('<H').pack(zlib.crc32(header) & 0xFFFF)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return header + compressobj.compress(data) + compressobj.flush() + Struct('<II').pack(zlib.crc32(data), len(data))
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+@pytest.mark.parametrize("suspend_size", [1, 7, 65536])
+def test_stream_inflate_gzip(use_zlib, input_size, suspend_size):
+    rnd = random.Random()
+    rnd.seed(1)
+    members = [
+        rnd.getrandbits(8000).to_bytes(1000, byteorder='big') * 10,
+        b'',
+        b'abcdefgh' * 1000,
+    ]
+    stream = gzip.compress(members[0], compresslevel=0) + gzip.compress(members[1]) + \
+        _gzip_member_with_all_fields(members[2]) + b'\x00Unconsumed'
+    content, total_attempted_consumed = _content(input_size)
+
+    # Members are uncompressed until the input runs out
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_gzip(chunk_size=1000, use_zlib=use_zlib)
+    uncompressed = b''.join(
+        uncompressed_chunk
+        for i in range(0, len(stream), suspend_size)
+        for uncompressed_chunk in uncompressed_chunks(content(stream[i:i + suspend_size]))
+    )
+    assert uncompressed == b''.join(members)
+    assert is_done()
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == b'\x00Unconsumed'
+
+
+@pytest.mark.parametrize("unconsumed", [b'\x1fnot gzip', b'\x1f'])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+@pytest.mark.parametrize("suspend_size", [1, 7, 65536])
+def test_stream_inflate_gzip_unconsumed_starting_with_1f(unconsumed, input_size, suspend_size):
+    # Bytes after a member that start with the first byte of the gzip magic, but not both, are
+    # not the start of another member
+    stream = gzip.compress(b'abcdefgh' * 1000) + unconsumed
+    content, total_attempted_consumed = _content(input_size)
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_gzip()
+    uncompressed = b''.join(
+        uncompressed_chunk
+        for i in range(0, len(stream), suspend_size)
+        for uncompressed_chunk in uncompressed_chunks(content(stream[i:i + suspend_size]))
+    )
+    assert uncompressed == b'abcdefgh' * 1000
+    assert is_done()
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == unconsumed
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("level", [0, 9])
+@pytest.mark.parametrize("input_size", [1, 7, 65536])
+@pytest.mark.parametrize("suspend_size", [1, 7, 65536])
+def test_stream_inflate_zlib(use_zlib, level, input_size, suspend_size):
+    rnd = random.Random()
+    rnd.seed(1)
+    data = rnd.getrandbits(8000).to_bytes(1000, byteorder='big') * 10
+    stream = zlib.compress(data, level) + b'Unconsumed'
+    content, total_attempted_consumed = _content(input_size)
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_zlib(chunk_size=1000, use_zlib=use_zlib)
+    uncompressed = b''
+    for i in range(0, len(stream), suspend_size):
+        uncompressed += b''.join(uncompressed_chunks(content(stream[i:i + suspend_size])))
+        if is_done():
+            break
+    assert uncompressed == data
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == b'Unconsumed'
+
+
+def test_stream_inflate_gzip_zlib_invalid():
+    with pytest.raises(InvalidHeader):
+        b''.join(stream_inflate_gzip()[0]((zlib.compress(b'abc'),)))
+
+    with pytest.raises(InvalidHeader):
+        b''.join(stream_inflate_zlib()[0]((gzip.compress(b'abc'),)))
+
+    with pytest.raises(InvalidHeader):
+        b''.join(stream_inflate_zlib()[0]((zlib.compressobj(zdict=b'abc').compress(b'abc'),)))
+
+    member = bytearray(_gzip_member_with_all_fields(b'abc'))
+    member[37] ^= 1
+    with pytest.raises(InvalidHeader):
+        b''.join(stream_inflate_gzip()[0]((member,)))
+
+    member = bytearray(gzip.compress(b'abc'))
+    member[-8] ^= 1
+    with pytest.raises(InvalidChecksum):
+        b''.join(stream_inflate_gzip()[0]((member,)))
+
+    member = bytearray(gzip.compress(b'abc'))
+    member[-4] ^= 1
+    with pytest.raises(InvalidChecksum):
+        b''.join(stream_inflate_gzip()[0]((member,)))
+
+    stream = bytearray(zlib.compress(b'abc'))
+    stream[-1] ^= 1
+    with pytest.raises(InvalidChecksum):
+        b''.join(stream_inflate_zlib()[0]((stream,)))
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+def test_stream_inflate_gzip_zlib_limits_and_skip(use_zlib):
+    data = b'abcdefgh' * 100000
+    member = gzip.compress(data)
+
+    # A single member, and the total of several members that are each under the limit
+    with pytest.raises(OutputLimitExceeded):
+        b''.join(stream_inflate_gzip(use_zlib=use_zlib, max_output_size=len(data) - 1)[0]((member,)))
+    with pytest.raises(OutputLimitExceeded):
+        b''.join(stream_inflate_gzip(use_zlib=use_zlib, max_output_size=len(data) + 1)[0]((member, member)))
+    with pytest.raises(OutputLimitExceeded):
+        b''.join(stream_inflate_gzip(use_zlib=use_zlib, max_ratio=100)[0]((member,)))
+    with pytest.raises(OutputLimitExceeded):
+        b''.join(stream_inflate_zlib(use_zlib=use_zlib, max_ratio=100)[0]((zlib.compress(data),)))
+    assert b''.join(stream_inflate_gzip(use_zlib=use_zlib, max_output_size=2 * len(data))[0]((member, member))) == data * 2
+
+    # Skipped bytes are still in the checksum, and can be across members
+    for skip in (0, 1, len(data), len(data) + 1, 2 * len(data)):
+        assert b''.join(stream_inflate_gzip(use_zlib=use_zlib, skip=skip)[0]((member, member))) == (data * 2)[skip:]
+    corrupt = bytearray(member)
+    corrupt[-8] ^= 1
+    with pytest.raises(InvalidChecksum):
+        b''.join(stream_inflate_gzip(use_zlib=use_zlib, skip=len(data))[0]((corrupt,)))
+
+    if not use_zlib:
+        blocks = []
+        assert b''.join(stream_inflate_zlib(on_block=blocks.append)[0]((zlib.compress(data),))) == data
+        assert blocks[-1].is_final
+        assert blocks[-1].uncompressed_end == len(data)
+
+
+@pytest.mark.parametrize("level", [0, 1, 9])
+def test_stream_inflate_seek(level):
+    rnd = random.Random()
+    rnd.seed(1)
+    data = b''.join(rnd.choice([b'alpha', b'beta', b'gamma']) + str(rnd.randint(0, 99999)).encode() for _ in range(100000))
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+
+    def content(stream):
+        for i in range(0, len(stream), 7777):
+            yield stream[i:i + 7777]
+
+    index = stream_inflate_index(content(stream), span=65536)
+    for offset in [0, 1, 65535, 65536, 100001, len(data) - 1, len(data)]:
+        compressed_offset, uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_seek(index, offset, chunk_size=1000)
+        uncompressed = b''.join(uncompressed_chunks(content(stream[compressed_offset:])))
+        assert uncompressed == data[offset:]
+        assert is_done()
+        assert num_bytes_unconsumed() == 10
+
+    # Seeking from the start only needs an empty history, so a small index is still a valid index
+    assert len(stream_inflate_index(content(stream), span=len(data) * 2)) < 100
+
+
+def test_stream_inflate_seek_invalid_index():
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(b'-' * 100000) + compressobj.flush()
+    index = stream_inflate_index((stream,))
+
+    with pytest.raises(InvalidIndex):
+        stream_inflate_seek(b'Not an index', 0)
+
+    with pytest.raises(InvalidIndex):
+        stream_inflate_seek(index[:-1], 0)
+
+    with pytest.raises(InvalidIndex):
+        stream_inflate_seek(Struct('<4sBBI').pack(b'SIIX', 1, 0, 0), 0)
+
+    corrupt = bytearray(index)
+    corrupt[30] ^= 0xFF
+    with pytest.raises(InvalidIndex):
+        stream_inflate_seek(corrupt, 0)
+
+    with pytest.raises(ValueError):
+        stream_inflate_seek(index, -1)
+
+    with pytest.raises(TruncatedStream):
+        stream_inflate_index((stream[:len(stream) // 2],))
+
+
+@pytest.mark.parametrize("strategy", [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FIXED])
+@pytest.mark.parametrize("level", [0, 1, 9])
+def test_stream_inflate_resumable(strategy, level):
+    rnd = random.Random()
+    rnd.seed(1)
+    data = b''.join(rnd.choice([b'alpha', b'beta', b'gamma']) + str(rnd.randint(0, 99999)).encode() for _ in range(30000))
+    data = data + rnd.getrandbits(800000).to_bytes(100000, byteorder='big') + data
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS, strategy=strategy)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+
+    def content(stream, input_size):
+        for i in range(0, len(stream), input_size):
+            yield stream[i:i + input_size]
+
+    uncompressed_chunks, is_done, _, checkpoint = stream_inflate_resumable(chunk_size=3001)
+    checkpoints = []
+    for i, _ in enumerate(uncompressed_chunks(content(stream, 997))):
+        if i % 37 == 0:
+            checkpoints.append(checkpoint())
+    assert is_done()
+    assert len(checkpoints) > 1
+
+    for compressed_offset, uncompressed_offset, state in checkpoints:
+        # The last input chunk may not be needed, so the bytes left over are from those consumed
+        resumed_content, total_attempted_consumed = _content(333)
+        uncompressed_chunks, is_done, num_bytes_unconsumed, _ = stream_inflate_resumable(state, chunk_size=4096)
+        uncompressed = b''.join(uncompressed_chunks(resumed_content(stream[compressed_offset:])))
+        assert uncompressed == data[uncompressed_offset:]
+        assert is_done()
+        assert compressed_offset + total_attempted_consumed() - num_bytes_unconsumed() == len(stream) - 10
+
+
+def test_stream_inflate_resumable_invalid_checkpoint():
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(b'-' * 100000) + compressobj.flush()
+    uncompressed_chunks, _, _, checkpoint = stream_inflate_resumable(chunk_size=1000)
+    next(iter(uncompressed_chunks((stream,))))
+    _, _, state = checkpoint()
+
+    with pytest.raises(InvalidCheckpoint):
+        stream_inflate_resumable(b'Not a checkpoint')
+
+    with pytest.raises(InvalidCheckpoint):
+        stream_inflate_resumable(state[:-1])
+
+    with pytest.raises(InvalidCheckpoint):
+        stream_inflate64_resumable(state)
+
+
+@pytest.mark.parametrize("flush", [zlib.Z_FULL_FLUSH, zlib.Z_SYNC_FLUSH, zlib.Z_NO_FLUSH])
+@pytest.mark.parametrize("level", [0, 6])
+@pytest.mark.parametrize("use_threads", [True, False])
+def test_stream_inflate_parallel(flush, level, use_threads):
+    rnd = random.Random()
+    rnd.seed(1)
+    # The bytes of a flush marker are also in the data, so some are in stored blocks
+    data = b''.join(rnd.choice([b'alpha', b'beta', b'\x00\x00\xff\xff']) + str(rnd.randint(0, 99999)).encode() for _ in range(50000))
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = b''.join(
+        compressobj.compress(data[i:i + 20000]) + compressobj.flush(flush)
+        for i in range(0, len(data), 20000)
+    ) + compressobj.flush() + b'Unconsumed'
+
+    executor = ThreadPoolExecutor(max_workers=2) if use_threads else None
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_parallel(stream, executor=executor, segment_size=5000)
+    assert b''.join(uncompressed_chunks) == data
+    assert is_done()
+    assert num_bytes_unconsumed() == 10
+
+
+def test_stream_inflate_parallel_without_flushes():
+    # A stream without full flushes is a single segment, which is uncompressed serially in pages,
+    # rather than the whole of it by a worker
+    class NoExecutor():
+        def submit(self, *args):
+            raise AssertionError('Not expected to use the executor')
+
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(bytes(50000000)) + compressobj.flush() + b'Unconsumed'
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_parallel(stream, executor=NoExecutor())
+    num_bytes = 0
+    for chunk in uncompressed_chunks:
+        assert len(chunk) <= 65536
+        num_bytes += len(chunk)
+    assert num_bytes == 50000000
+    assert is_done()
+    assert num_bytes_unconsumed() == 10
+
+
+def test_stream_inflate_parallel_large_segments(tmp_path):
+    # Segments that are more than max_segment_output_size uncompressed are not returned whole by
+    # workers, and the rest of the stream is uncompressed serially in pages, from slices of the
+    # mmap rather than a copy of all of it, and the mmap can be closed after
+    data = bytes(1000000) + _data(0, 100000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = b''.join(
+        compressobj.compress(data[i:i + 200000]) + compressobj.flush(zlib.Z_FULL_FLUSH)
+        for i in range(0, len(data), 200000)
+    ) + compressobj.flush() + b'Unconsumed'
+    with open(tmp_path / 'stream.bin', 'wb') as f:
+        f.write(stream)
+
+    with \
+            open(tmp_path / 'stream.bin', 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as compressed:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_parallel(compressed, executor=executor, segment_size=100, max_segment_output_size=1600)
+            chunks = [bytes(chunk) for chunk in uncompressed_chunks]
+        assert b''.join(chunks) == data
+        assert max(len(chunk) for chunk in chunks) <= 65536
+        assert is_done()
+        assert num_bytes_unconsumed() == 10
+
+
+# The number of bytes of each chunk uncompressed serially by stream_inflate_parallel after a
+# segment that a worker couldn't uncompress, rather than by a worker
+def _spy_parallel_serial_num_bytes(monkeypatch):
+    serial_num_bytes = []
+    _stream_inflate = stream_inflate_module._stream_inflate
+
+    def spy(*args, **kwargs):
+        inflater = _stream_inflate(*args, **kwargs)
+        if kwargs.get('resume_from') is None:
+            return inflater
+
+        def uncompressed_chunks(compressed_chunks):
+            for chunk in inflater.uncompressed_chunks(compressed_chunks):
+                serial_num_bytes.append(len(chunk))
+                yield chunk
+
+        return inflater._replace(uncompressed_chunks=uncompressed_chunks)
+
+    monkeypatch.setattr(stream_inflate_module, '_stream_inflate', spy)
+    return serial_num_bytes
+
+
+def test_stream_inflate_parallel_high_ratio(monkeypatch):
+    # Segments that uncompress to many times their compressed size are still uncompressed by the
+    # workers, rather than serially
+    serial_num_bytes = _spy_parallel_serial_num_bytes(monkeypatch)
+
+    rnd = random.Random()
+    rnd.seed(1)
+    data = b''.join(
+        b'{"level": "info", "message": "request handled", "status": 200, "id": ' + str(rnd.randint(0, 99)).encode() + b'}\n'
+        for _ in range(20000)
+    )
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    segments = [
+        compressobj.compress(data[i:i + 100000]) + compressobj.flush(zlib.Z_FULL_FLUSH)
+        for i in range(0, len(data), 100000)
+    ]
+    stream = b''.join(segments) + compressobj.flush() + b'Unconsumed'
+    assert max(len(segment) for segment in segments) * 16 < 100000
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_parallel(stream, executor=executor, segment_size=1000)
+        assert b''.join(uncompressed_chunks) == data
+    assert is_done()
+    assert num_bytes_unconsumed() == 10
+    assert serial_num_bytes == []
+
+
+def test_stream_inflate_parallel_false_flush_marker(monkeypatch):
+    # A flush marker in stored random data isn't a split, but the segments after the next real
+    # split are still uncompressed by the workers rather than serially
+    serial_num_bytes = _spy_parallel_serial_num_bytes(monkeypatch)
+
+    rnd = random.Random()
+    rnd.seed(1)
+    random_data = rnd.getrandbits(48000).to_bytes(6000, byteorder='big') + b'\x00\x00\xff\xff' + rnd.getrandbits(112000).to_bytes(14000, byteorder='big')
+    data = random_data + b''.join(rnd.choice([b'alpha', b'beta', b'gamma']) + str(rnd.randint(0, 99999)).encode() for _ in range(20000))
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = b''.join(
+        compressobj.compress(data[i:i + 20000]) + compressobj.flush(zlib.Z_FULL_FLUSH)
+        for i in range(0, len(data), 20000)
+    ) + compressobj.flush() + b'Unconsumed'
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate_parallel(stream, executor=executor, segment_size=5000)
+        assert b''.join(uncompressed_chunks) == data
+    assert is_done()
+    assert num_bytes_unconsumed() == 10
+    assert 0 < sum(serial_num_bytes) <= len(random_data)
+
+
+@pytest.mark.parametrize("level,strategy,block_type", [
+    (0, zlib.Z_DEFAULT_STRATEGY, 'stored'),
+    (9, zlib.Z_FIXED, 'fixed'),
+    (9, zlib.Z_DEFAULT_STRATEGY, 'dynamic'),
+])
+@pytest.mark.parametrize("input_size", [7, 65536])
+def test_stream_inflate_on_block(level, strategy, block_type, input_size):
+    rnd = random.Random()
+    rnd.seed(1)
+    data = b''.join(rnd.choice([b'alpha', b'beta', b'gamma']) + str(rnd.randint(0, 999)).encode() for _ in range(50000))
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS, strategy=strategy)
+    stream = compressobj.compress(data) + compressobj.flush()
+
+    blocks = []
+    uncompressed = b''.join(stream_inflate(chunk_size=1000, on_block=blocks.append)[0](
+        stream[i:i + input_size] for i in range(0, len(stream), input_size)
+    ))
+    assert uncompressed == data
+
+    assert all(isinstance(block, BlockStats) for block in blocks)
+    assert all(block.block_type == block_type for block in blocks)
+    assert [block.is_final for block in blocks] == [False] * (len(blocks) - 1) + [True]
+    assert blocks[0].compressed_bit_start == 0
+    assert (blocks[-1].compressed_bit_end + 7) // 8 == len(stream)
+    assert blocks[0].uncompressed_start == 0
+    assert blocks[-1].uncompressed_end == len(data)
+    for block, next_block in zip(blocks, blocks[1:]):
+        assert block.compressed_bit_end == next_block.compressed_bit_start
+        assert block.uncompressed_end == next_block.uncompressed_start
+
+    for block in blocks:
+        assert block.num_literals + round(block.num_matches * block.average_match_length) == \
+            (0 if block_type == 'stored' else block.uncompressed_end - block.uncompressed_start)
+        assert (block.num_matches > 0) == (block_type != 'stored')
+        assert block.header_seconds > 0
+        assert block.decode_seconds > 0
+
+
+@pytest.mark.parametrize("fast_huffman", [True, False])
+@pytest.mark.parametrize("level", [1, 9])
+@pytest.mark.parametrize("input_size", [1, 17, 65536])
+@pytest.mark.parametrize("output_size", [7, 65536])
+def test_stream_inflate_fast_huffman(monkeypatch, fast_huffman, level, input_size, output_size):
+    # The fast path is only used by default when compiled, but it also runs as plain Python
+    monkeypatch.setattr(stream_inflate_module, '_fast_huffman', fast_huffman)
+
+    rnd = random.Random()
+    rnd.seed(1)
+    data = b''.join(rnd.choice([b'alpha', b'beta', b'gamma']) + str(rnd.randint(0, 999)).encode() for _ in range(20000))
+    data += b'a' * 100000 + rnd.getrandbits(80000).to_bytes(10000, byteorder='big') + data
+    compressobj = zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush() + b'Unconsumed'
+    content, total_attempted_consumed = _content(input_size)
+
+    uncompressed_chunks, is_done, num_bytes_unconsumed = stream_inflate(chunk_size=output_size)
+    uncompressed = b''.join(uncompressed_chunks(content(stream)))
+    assert uncompressed == data
+    assert is_done()
+    assert stream[total_attempted_consumed() - num_bytes_unconsumed():] == b'Unconsumed'
+
+
+def test_stream_inflate_without_cython():
+    code = '''
+import sys, zlib
+sys.modules['cython'] = None
+import stream_inflate
+compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+stream = compressobj.compress(b'-' * 100000) + compressobj.flush()
+assert b''.join(stream_inflate.stream_inflate()[0]((stream,))) == b'-' * 100000
+'''
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+@pytest.mark.parametrize("use_zlib", [False, True])
+@pytest.mark.parametrize("read_size", [7, 1048576])
+def test_main(tmp_path, capsys, use_zlib, read_size):
+    data = _data(1000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+    (tmp_path / 'compressed').write_bytes(b'Header' + stream + b'Unconsumed')
+
+    args = [str(tmp_path / 'compressed'), '-o', str(tmp_path / 'uncompressed'), '--offset', '6', '--read-size', str(read_size), '--chunk-size', '1000', '--stats']
+    assert stream_inflate_cli.main(args + (['--use-zlib'] if use_zlib else [])) == 0
+    assert (tmp_path / 'uncompressed').read_bytes() == data
+    stats = capsys.readouterr().err
+    assert '{} bytes from {} bytes'.format(len(data), len(stream)) in stats
+    assert '10 bytes after the stream' in stats
+
+    # The bytes after the stream in a seekable input are counted from its size, not by reading
+    # them, here a (sparse) 4GiB that would be slow to read 1000 bytes at a time
+    with open(tmp_path / 'compressed', 'r+b') as f:
+        f.truncate(6 + len(stream) + (1 << 32))
+    assert stream_inflate_cli.main(args + (['--use-zlib'] if use_zlib else [])) == 0
+    assert '{} bytes after the stream'.format(1 << 32) in capsys.readouterr().err
+
+    (tmp_path / 'compressed').write_bytes(stream[:len(stream) // 2])
+    assert stream_inflate_cli.main([str(tmp_path / 'compressed'), '-o', str(tmp_path / 'uncompressed')]) == 1
+    assert 'TruncatedStream' in capsys.readouterr().err
+
+
+def test_main_module():
+    stream, data = _deflate64_fixture()
+
+    result = subprocess.run([sys.executable, '-m', 'stream_inflate_cli', '--deflate64', '--stats'], input=stream, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    assert result.stdout == data
+    assert re.search(br'at least \d+ bytes after the stream', result.stderr)
+    assert (b'compiled' if stream_inflate_module._compiled else b'pure Python') in result.stderr
+
+
+def test_main_offset_from_pipe():
+    data = _data(1000)
+    compressobj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+
+    # The bytes before the offset arrive in separate writes to the pipe, so are read separately
+    process = subprocess.Popen([sys.executable, '-m', 'stream_inflate_cli', '--offset', '6'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    process.stdin.write(b'Hea')
+    process.stdin.flush()
+    time.sleep(0.5)
+    process.stdin.write(b'der' + stream)
+    process.stdin.close()
+    assert process.stdout.read() == data
+    process.stdout.close()
+    assert process.wait() == 0
+
+    result = subprocess.run([sys.executable, '-m', 'stream_inflate_cli', '--offset', '6'], input=b'Head', stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 1
+    assert b'2 bytes before the offset' in result.stderr
+
+
 def test_stream_inflate_many_fixed_huffman():
     # Manually constructs a deflate stream with more "fixed" huffman values than the cache size,
     # which forces the code to hit certain lines. Not sure a well behaved compressor would ever
     # do this, because it wouldn't bother Huffman encoding so many values, and instead use non
     # compressed blocks
-    out = bytearray(100002)
-    offset = 0
-    bit_offset = 0
-    def write_bit(bit):
-        nonlocal bit_offset, offset
-        if bit_offset == 8:
-            offset += 1
-            bit_offset = 0
-        out[offset] |= (bit << bit_offset)
-        bit_offset += 1
-    def write_num(num, length):
-        # Probably not the most efficient thing in the world
-        bit_string = "{0:b}".format(num)
-        bit_string = "0" * (length - len(bit_string)) + bit_string
-        for bit in reversed(bit_string):
-            write_bit(int(bit))
+    out, write_bit, write_num = _bit_writer(100002)
 
     write_bit(1)       # Final block
     write_num(1, 2)    # Fixed Huffman block
@@ -88,6 +1156,52 @@ def test_stream_inflate_many_fixed_huffman():
     assert out == b'\x00' * 100000
 
 
+@pytest.mark.parametrize("chunk_size", [1000, 65536])
+@pytest.mark.parametrize("input_size", [7, 65536, 1000000])
+def test_stream_inflate_stored_without_copying(chunk_size, input_size):
+    data = _data(0, 200000)
+    compressobj = zlib.compressobj(level=0, wbits=-zlib.MAX_WBITS)
+    stream = compressobj.compress(data) + compressobj.flush()
+    input_chunks = [stream[i:i + input_size] for i in range(0, len(stream), input_size)]
+
+    pages = list(stream_inflate(chunk_size=chunk_size)[0](input_chunks))
+    assert b''.join(pages) == data
+    assert all(len(page) <= chunk_size for page in pages)
+
+    # Every page is a view of the input, even with a chunk_size larger than any stored block
+    assert all(isinstance(page, memoryview) for page in pages)
+    assert all(any(page.obj is input_chunk for input_chunk in input_chunks) for page in pages)
+
+
+@pytest.mark.parametrize("inflater,length_code,length_extra,dist_code,dist_extra,dist", [
+    # Length 258 with Deflate's length code 285, and with Deflate64's, which has 16 extra bits
+    (stream_inflate, '11000101', None, '10011', (231, 8), 1000),
+    (stream_inflate64, '11000101', (255, 16), '10011', (231, 8), 1000),
+    (stream_inflate64, '11000101', (255, 16), '11110', (7231, 14), 40000),
+])
+@pytest.mark.parametrize("input_size", [7, 1000000])
+@pytest.mark.parametrize("chunk_size", [7, 1000, 65536])
+def test_stream_inflate_back_reference_into_stored(inflater, length_code, length_extra, dist_code, dist_extra, dist, input_size, chunk_size):
+    # A stored block, which can be returned as views of the input rather than copied into the
+    # window, followed by a fixed Huffman block that refers back into the stored block
+    stored = _data(0, 65535)
+    out, write_bit, write_num = _bit_writer(32)
+    write_bit(1)       # Final block
+    write_num(1, 2)    # Fixed Huffman block
+    for bit in length_code:
+        write_bit(int(bit))
+    if length_extra:
+        write_num(*length_extra)
+    for bit in dist_code:
+        write_bit(int(bit))
+    write_num(*dist_extra)
+    write_num(0, 7)    # Stop code
+    stream = b'\x00' + Struct('<HH').pack(len(stored), len(stored) ^ 0xFFFF) + stored + bytes(out)
+
+    uncompressed = b''.join(inflater(chunk_size=chunk_size)[0](_content(input_size)[0](stream)))
+    assert uncompressed == stored + stored[-dist:-dist + 258]
+
+
 def test_unsupported_block_type():
     # Manually constuct a "stream" that has a block type of 3, which is not supported
     # (All 1s in a single byte forces is a quick way to force this: most of the bits are ignored)
@@ -95,24 +1209,13 @@ def test_unsupported_block_type():
         b''.join(stream_inflate()[0]((b'\xFF',)))
 
 
-def test_stream_inflate_backwards_too_far():
-    # Manually constructs a deflate stream that attempts to look backwards too far
-    out = bytearray(2)
-    offset = 0
-    bit_offset = 0
-    def write_bit(bit):
-        nonlocal bit_offset, offset
-        if bit_offset == 8:
-            offset += 1
-            bit_offset = 0
-        out[offset] |= (bit << bit_offset)
-        bit_offset += 1
-    def write_num(num, length):
-        # Probably not the most efficient thing in the world
-        bit_string = "{0:b}".format(num)
-        bit_string = "0" * (length - len(bit_string)) + bit_string
-        for bit in reversed(bit_string):
-            write_bit(int(bit))
+@pytest.mark.parametrize("fast_huffman", [True, False])
+def test_stream_inflate_backwards_too_far(monkeypatch, fast_huffman):
+    monkeypatch.setattr(stream_inflate_module, '_fast_huffman', fast_huffman)
+
+    # Manually constructs a deflate stream that attempts to look backwards too far, with enough
+    # padding after it so it's reached by the fast path
+    out, write_bit, write_num = _bit_writer(32)
 
     write_bit(1)       # Final block
     write_num(1, 2)    # Fixed Huffman block
@@ -122,6 +1225,132 @@ def test_stream_inflate_backwards_too_far():
         b''.join(stream_inflate()[0]((bytes(out),)))
 
 
+@pytest.mark.parametrize("fast_huffman", [True, False])
+@pytest.mark.parametrize("inflater,codes,error", [
+    (stream_inflate, ('11000110',), InvalidHuffmanCode),              # Length code 286
+    (stream_inflate, ('11000111',), InvalidHuffmanCode),              # Length code 287
+    (stream_inflate, ('0000001', '11110'), InvalidHuffmanCode),       # Length code 257, distance code 30
+    (stream_inflate, ('0000001', '11111'), InvalidHuffmanCode),       # Length code 257, distance code 31
+    (stream_inflate64, ('11000110',), InvalidHuffmanCode),            # Length code 286
+    (stream_inflate64, ('0000001', '11110'), BackwardsTooFar),        # Distance code 30 is valid in Deflate64
+])
+def test_stream_inflate_invalid_length_or_dist_code(monkeypatch, fast_huffman, inflater, codes, error):
+    monkeypatch.setattr(stream_inflate_module, '_fast_huffman', fast_huffman)
+
+    # Manually constructs a deflate stream with a fixed Huffman block that uses a length or
+    # distance code that has a fixed Huffman code, but isn't valid, with enough padding after it
+    # so it's reached by the fast path
+    out, write_bit, write_num = _bit_writer(32)
+
+    write_bit(1)       # Final block
+    write_num(1, 2)    # Fixed Huffman block
+    write_num(0b10001001, 8)   # Literal a, reversed
+    for code in codes:
+        for bit in code:
+            write_bit(int(bit))
+
+    with pytest.raises(error):
+        b''.join(inflater()[0]((bytes(out),)))
+
+
+@pytest.mark.parametrize("fast_huffman", [True, False])
+def test_stream_inflate_invalid_huffman_code(monkeypatch, fast_huffman):
+    monkeypatch.setattr(stream_inflate_module, '_fast_huffman', fast_huffman)
+
+    # Manually constructs a deflate stream with a dynamic block whose literal/length code is
+    # incomplete, and then uses one of the sequences of bits that isn't a code
+    out, write_bit, write_num = _bit_writer(64)
+
+    write_bit(1)       # Final block
+    write_num(2, 2)    # Dynamic Huffman block
+    write_num(0, 5)    # 257 literal/length codes
+    write_num(0, 5)    # 1 distance code
+    write_num(12, 4)   # 16 code length codes
+
+    # Code lengths of the code length codes, in the order 16, 17, 18, 0, 8, 7, 9, 6, 10, 5,
+    # 11, 4, 12, 3, 13, 2, where only 0 and 2 are used, with codes 0 and 1 respectively
+    for code_length_code in (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2):
+        write_num(1 if code_length_code in (0, 2) else 0, 3)
+
+    # Only the literal A and the stop code are given (2 bit) codes, 00 and 01
+    for i in range(0, 258):
+        write_bit(1 if i in (65, 256) else 0)
+
+    write_num(3, 2)    # 11, which isn't a code
+
+    with pytest.raises(InvalidHuffmanCode):
+        b''.join(stream_inflate()[0]((bytes(out),)))
+
+
+@pytest.mark.parametrize("codes", [
+    (('10', (0, 2)),),                        # Repeat the previous code length, but there isn't one
+    (('11', (127, 7)), ('11', (127, 7))),     # 138 zero code lengths twice, past the 258
+    (('00', None),) * 256 + (('10', (0, 2)),),   # 3 repeats of a code length, 1 past the 258
+])
+def test_stream_inflate_invalid_code_length_repeat(codes):
+    # Manually constructs a deflate stream with a dynamic block whose code lengths use the code
+    # length repeat codes 16 and 18 in ways that aren't valid
+    out, write_bit, write_num = _bit_writer(128)
+
+    write_bit(1)       # Final block
+    write_num(2, 2)    # Dynamic Huffman block
+    write_num(0, 5)    # 257 literal/length codes
+    write_num(0, 5)    # 1 distance code
+    write_num(12, 4)   # 16 code length codes
+
+    # Code lengths of the code length codes, in the order 16, 17, 18, 0, 8, 7, 9, 6, 10, 5,
+    # 11, 4, 12, 3, 13, 2, where only 0, 2, 16 and 18 are used, with codes 00, 01, 10 and 11
+    for code_length_code in (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2):
+        write_num(2 if code_length_code in (0, 2, 16, 18) else 0, 3)
+
+    for code, extra in codes:
+        for bit in code:
+            write_bit(int(bit))
+        if extra is not None:
+            write_num(*extra)
+
+    with pytest.raises(InvalidHuffmanCode):
+        b''.join(stream_inflate()[0]((bytes(out),)))
+
+
+@pytest.mark.parametrize("lengths", [
+    (10, 1, 1, 1, 12, 12, 12, 12),
+    (1, 1, 1),
+    (2, 2, 2, 2, 2),
+    (1, 2, 2, 3),
+])
+def test_get_huffman_codes_over_subscribed(lengths):
+    with pytest.raises(InvalidHuffmanCode):
+        stream_inflate_module._get_huffman_codes(lengths, 9, 286)
+
+
+def test_stream_inflate_over_subscribed_huffman_code():
+    # Manually constructs a deflate stream with a dynamic block whose literal/length code has 5
+    # codes of 2 bits, but there are only 4 of those. Without a check the stop code would overlap
+    # the code for A, and the stream would be uncompressed without an error
+    out, write_bit, write_num = _bit_writer(64)
+
+    write_bit(1)       # Final block
+    write_num(2, 2)    # Dynamic Huffman block
+    write_num(0, 5)    # 257 literal/length codes
+    write_num(0, 5)    # 1 distance code
+    write_num(12, 4)   # 16 code length codes
+
+    # Code lengths of the code length codes, in the order 16, 17, 18, 0, 8, 7, 9, 6, 10, 5,
+    # 11, 4, 12, 3, 13, 2, where only 0 and 2 are used, with codes 0 and 1 respectively
+    for code_length_code in (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2):
+        write_num(1 if code_length_code in (0, 2) else 0, 3)
+
+    # The literals A, B, C and D and the stop code are given 2 bit codes
+    for i in range(0, 258):
+        write_bit(1 if i in (65, 66, 67, 68, 256) else 0)
+
+    write_num(0, 2)    # 00, the code for A
+
+    with pytest.raises(InvalidHuffmanCode):
+        b''.join(stream_inflate()[0]((bytes(out),)))
+
+
 @pytest.mark.parametrize("input_size", [1, 7, 65536])
 @pytest.mark.parametrize("output_size", [1, 7, 65536])
 def test_stream_inflate64(input_size, output_size):
@@ -135,3 +1364,88 @@ def test_stream_inflate64(input_size, output_size):
 
     uncompressed = b''.join(stream_inflate64(chunk_size=output_size)[0](content(input_size)))
     assert uncompressed == data
+
+
+@pytest.mark.parametrize("input_size", [7, 65536])
+@pytest.mark.parametrize("buffer_size", [7, 65536])
+def test_stream_inflate64_into(input_size, buffer_size):
+    stream, data = _deflate64_fixture()
+
+    uncompressed_into, is_done, _ = stream_inflate64_into()
+    buffer = bytearray(buffer_size)
+    uncompressed = bytearray()
+    num_bytes = uncompressed_into(_content(input_size)[0](stream), buffer)
+    while num_bytes:
+        uncompressed += buffer[:num_bytes]
+        num_bytes = uncompressed_into((), buffer)
+    assert is_done()
+    assert uncompressed == data
+
+
+def test_stream_inflate64_file():
+    stream, data = _deflate64_fixture()
+
+    assert stream_inflate64_file(io.BytesIO(stream)).read() == data
+
+
+@pytest.mark.parametrize("input_size", [7, 65536])
+def test_stream_inflate64_async(input_size):
+    stream, data = _deflate64_fixture()
+
+    async def content():
+        for chunk in _content(input_size)[0](stream):
+            yield chunk
+
+    async def uncompress():
+        return b''.join([
+            chunk async for chunk in stream_inflate64_async(chunk_size=1000)[0](content())
+        ])
+
+    assert asyncio.run(uncompress()) == data
+
+
+@pytest.mark.parametrize("input_size", [7, 65536])
+def test_stream_inflate64_skip(input_size):
+    stream, data = _deflate64_fixture()
+
+    uncompressed = b''.join(stream_inflate64(chunk_size=1000, skip=100000)[0](_content(input_size)[0](stream)))
+    assert uncompressed == data[100000:]
+
+    uncompressed_size, compressed_size, _ = stream_inflate64_size(_content(input_size)[0](stream))
+    assert uncompressed_size == len(data)
+    assert compressed_size == stream.index(b'PK\x01\x02')
+
+
+@pytest.mark.parametrize("uncompressed_size_known", [True, False])
+def test_stream_inflate64_buffer(uncompressed_size_known):
+    stream, data = _deflate64_fixture()
+
+    uncompressed, num_bytes_unconsumed = stream_inflate64_buffer(stream, len(data) if uncompressed_size_known else None)
+    assert uncompressed == data
+    assert stream[len(stream) - num_bytes_unconsumed:].startswith(b'PK\x01\x02')
+
+
+def test_stream_inflate64_seek():
+    stream, data = _deflate64_fixture()
+
+    index = stream_inflate64_index(_content(65536)[0](stream), span=65536)
+    for offset in [0, 100000, len(data) - 1]:
+        compressed_offset, uncompressed_chunks, is_done, _ = stream_inflate_seek(index, offset, chunk_size=1000)
+        uncompressed = b''.join(uncompressed_chunks(_content(7777)[0](stream[compressed_offset:])))
+        assert uncompressed == data[offset:]
+        assert is_done()
+
+
+@pytest.mark.parametrize("input_size", [7, 65536])
+def test_stream_inflate64_zip(input_size):
+    # A ZIP file with one Deflate64 member, since the fixture is a ZIP file without its local header
+    stream, data = _deflate64_fixture()
+    zipped = b'PK\x03\x04' + Struct('<HHHHHIIIHH').pack(
+        20, 0, 9, 0, 0, zlib.crc32(data), stream.index(b'PK\x01\x02'), len(data), len(b'data.bin'), 0,
+    ) + b'data.bin' + stream
+
+    uncompressed = [
+        (member.file_name, member.compression_method, b''.join(uncompressed_chunks))
+        for member, uncompressed_chunks in stream_inflate_zip(_content(input_size)[0](zipped))
+    ]
+    assert uncompressed == [(b'data.bin', 9, data)]